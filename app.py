@@ -1,102 +1,211 @@
 import json
+import mimetypes
+import os
 from datetime import datetime
 
-from flask import Flask, render_template, request
+from flask import Flask, render_template, request, make_response, url_for, jsonify, send_from_directory
+from markupsafe import Markup, escape
 from flask_apscheduler import APScheduler
+from werkzeug.http import is_resource_modified
+from werkzeug.security import safe_join
 from updater import check_for_patch
-import sqlite3
+from newfiltering import refresh_stale
+from pagecache import page_cache, current_generation, last_modified, page_etag
+from migrations import migrate
+from freeze import freeze
+from staticbuild import build as build_assets, asset_url, asset_version, BUILD_DIR
+from imagevariants import picture
+from sprites import sprite, sprite_stylesheet
+from db import get_connection, get_patches, get_patch_by_id, get_timeline, get_newest, search_changes, get_stat_changes
 import logging
 from flask_babel import Babel, format_datetime
 
 app = Flask(__name__)
-database = "patch.db"
 log = logging.getLogger(__name__)
 log.setLevel(logging.WARNING)
 
 
 class Config:
     SCHEDULER_API_ENABLED = True
+    PAGE_CACHE_SIZE = 256
+    PAGE_SIZE = 20
+    MAX_PAGE_SIZE = 100
+    ASSET_MAX_AGE = 365 * 24 * 3600
+    SEARCH_LIMIT = 50
+    # when set, the static export in this directory is refreshed after every ingest
+    FREEZE_DIR = os.environ.get("FREEZE_DIR")
 app.config.from_object(Config)
+page_cache.max_entries = app.config['PAGE_CACHE_SIZE']
+migrate()
+build_assets()
+app.add_template_global(asset_url)
+app.add_template_global(picture)
+app.add_template_global(sprite)
+app.add_template_global(sprite_stylesheet)
 scheduler = APScheduler()
 scheduler.init_app(app)
 
 
-def init_db():
-    conn = sqlite3.connect(database)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS patches (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    title TEXT,
-                    content TEXT,
-                    content_filtered TEXT,
-                    link TEXT,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    date TEXT
-                 )''')
-    conn.commit()
-    conn.close()
-
-init_db()
-
-
-@scheduler.task('interval', id='check_for_patch_job', minutes=3)
+# ticks every minute, check_for_patch decides from its stored state whether a poll is due
+@scheduler.task('interval', id='check_for_patch_job', minutes=1)
 def scheduled_check():
-    print("[scheduler] Checking for new patches...")
-    check_for_patch()
-    pass
-
-
-def get_patches():
-    conn = sqlite3.connect(database)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("SELECT id, title, content, content_filtered, link, timestamp, date FROM patches ORDER BY timestamp DESC")
-    patches = c.fetchall()
-
-    patches = [dict(patch) for patch in patches]
+    if check_for_patch() and app.config['FREEZE_DIR']:
+        freeze(app, app.config['FREEZE_DIR'])
 
-    for patch in patches:
-        if patch['content_filtered']:
-            patch['content_filtered'] = json.loads(patch['content_filtered'])
 
-    c.execute("SELECT id, title, content, content_filtered, link, timestamp, date FROM patches WHERE id = (SELECT MAX(id) FROM patches)")
-    newest = c.fetchone()
-    conn.close()
+def cached_page(key, render, mimetype="text/html"):
+    # pages only change when ingestion bumps the generation or an asset build rewrites the hashed urls
+    # they embed, so serve 304s / cached html until then
+    assets, built = asset_version()
+    data = current_generation(get_connection())
+    generation = f"{data}:{assets}"
+    etag = page_etag(key, generation)
+    modified = last_modified(max(float(data), built))
 
-    return patches, newest
-
-
-def get_patch_by_id(patch_id):
-    conn = sqlite3.connect(database)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("SELECT id, title, content, content_filtered, link, timestamp, date FROM patches WHERE id = ?", (patch_id,))
-    patch = c.fetchone()
-    c.execute("SELECT id, title, content, content_filtered, link, timestamp, date FROM patches WHERE id = (SELECT MAX(id) FROM patches)")
-    newest = c.fetchone()
-    conn.close()
-
-    if patch:
-        patch = dict(patch)
-        if patch['content_filtered']:
-            patch['content_filtered'] = json.loads(patch['content_filtered'])
-        return patch, newest
-    return None
+    if not is_resource_modified(request.environ, etag=etag, last_modified=modified):
+        response = make_response("", 304)
+    else:
+        body = page_cache.get(key, generation)
+        if body is None:
+            body = render()
+            page_cache.put(key, generation, body)
+        response = make_response(body)
+        response.mimetype = mimetype
+
+    response.set_etag(etag)
+    response.last_modified = modified
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response
+
+
+@app.route('/static/dist/<path:filename>')
+def built_asset(filename):
+    # hashed names never change content: cacheable forever, the .br / .gz sibling is sent when accepted
+    directory = os.path.join(app.root_path, BUILD_DIR)
+    response = None
+    for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+        packed = safe_join(directory, filename + suffix)
+        if request.accept_encodings[encoding] > 0 and packed and os.path.isfile(packed):
+            response = send_from_directory(directory, filename + suffix, max_age=app.config['ASSET_MAX_AGE'],
+                                           mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream")
+            response.content_encoding = encoding
+            break
+    if response is None:
+        response = send_from_directory(directory, filename, max_age=app.config['ASSET_MAX_AGE'])
+    response.vary.add("Accept-Encoding")
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def render_home(before=None):
+    patches, newest, next_cursor = get_patches(before, app.config['PAGE_SIZE'])
+    return render_template('index.html', patches=patches, newest=newest, next_cursor=next_cursor)
+
+
+def page_size():
+    limit = request.args.get('limit', app.config['PAGE_SIZE'], type=int)
+    return max(1, min(limit, app.config['MAX_PAGE_SIZE']))
 
 
 @app.route('/')
 def home():
-    patches = get_patches()
-    return render_template('index.html', patches=patches[0], newest=patches[1])
+    return cached_page("home", render_home)
+
+@app.route('/before/<int:id>')
+def older(id):
+    return cached_page(f"home:{id}", lambda: render_home(id))
 
 @app.route('/patchnote/<int:id>')
 def notes(id):
-    patch = get_patch_by_id(id)
-    if patch:
-        return render_template('post.html', patch=patch[0], newest=patch[1])
-    else:
-        patches = get_patches()
-        return render_template('index.html', patches=patches[0], newest=patches[1])
+    def render_notes():
+        patch = get_patch_by_id(id)
+        if patch:
+            return render_template('post.html', patch=patch[0], newest=patch[1])
+        return render_home()
+
+    return cached_page(f"notes:{id}", render_notes)
+
+def render_timeline(entity_type, name):
+    timeline = get_timeline(entity_type, name)
+    if timeline:
+        return render_template('timeline.html', entity_type=entity_type, entity=timeline[0]['entity'],
+                               timeline=timeline, newest=get_newest())
+    return render_home()
+
+@app.route('/hero/<name>')
+def hero_timeline(name):
+    return cached_page(f"hero:{name.lower()}", lambda: render_timeline("hero", name))
+
+@app.route('/item/<name>')
+def item_timeline(name):
+    return cached_page(f"item:{name.lower()}", lambda: render_timeline("item", name))
+
+def run_search():
+    query = request.args.get('q', '').strip()
+    filters = {key: request.args.get(key) or None for key in ('hero', 'item', 'kind')}
+    results = search_changes(query, limit=app.config['SEARCH_LIMIT'], **filters) if query else []
+    for result in results:
+        # escape first, then turn the fts highlight markers into <mark>
+        result['highlight'] = Markup(str(escape(result['highlight'])).replace('\x02', '<mark>').replace('\x03', '</mark>'))
+    return query, filters, results
+
+@app.route('/search')
+def search():
+    query, filters, results = run_search()
+    return render_template('search.html', query=query, filters=filters, results=results, newest=get_newest())
+
+@app.route('/api/search')
+def api_search():
+    query, filters, results = run_search()
+    for result in results:
+        result['highlight'] = str(result['highlight'])
+        result['url'] = url_for('notes', id=result['patch_id'])
+    return jsonify({"query": query, "filters": filters, "results": results})
+
+def iso_timestamp(value):
+    # ?since=2024, 2024-05, 2024-05-01 or a full iso timestamp, in the same text form as patches.timestamp
+    # (compared as forum-local time); anything else raises ValueError and the filter is dropped
+    value = value.strip()
+    if len(value) in (4, 7):
+        value += "-01-01"[len(value) - 4:]
+    return datetime.fromisoformat(value).strftime("%Y-%m-%dT%H:%M:%S")
+
+@app.route('/api/changes')
+def api_changes():
+    filters = {
+        "stat": request.args.get('stat', '').strip().lower() or None,
+        "kind": request.args.get('kind') if request.args.get('kind') in ('buff', 'nerf', 'other') else None,
+        "min_delta": request.args.get('min_delta', type=float),
+        "since": request.args.get('since', type=iso_timestamp),
+    }
+    limit = min(request.args.get('limit', app.config['SEARCH_LIMIT'], type=int), app.config['MAX_PAGE_SIZE'])
+    changes = get_stat_changes(**filters, limit=max(limit, 1))
+    for change in changes:
+        change['url'] = url_for('notes', id=change['patch_id'])
+    return jsonify({"filters": filters, "changes": changes})
+
+# /api/before/<cursor> is the json twin of /before/<id>: next links use it, so a frozen export can serve every
+# page as a file (nothing can live under /api/patches, which is a file there)
+@app.route('/api/patches')
+@app.route('/api/before/<int:before>')
+def api_patches(before=None):
+    before = before or request.args.get('before', type=int)
+    limit = page_size()
+
+    def render_listing():
+        patches, newest, next_cursor = get_patches(before, limit)
+        for patch in patches:
+            patch['url'] = url_for('notes', id=patch['id'])
+        return json.dumps({
+            "patches": patches,
+            "newest": newest['id'] if newest else None,
+            "next": url_for('api_patches', before=next_cursor,
+                            limit=limit if limit != app.config['PAGE_SIZE'] else None) if next_cursor else None,
+        })
+
+    return cached_page(f"api:patches:{before}:{limit}", render_listing, mimetype="application/json")
 
 
 # time
@@ -130,6 +239,9 @@ def format_date_eu(value):
 
 
 if __name__ == "__main__":
-    check_for_patch()
+    refresh_stale()
+    check_for_patch(force=True)
+    if app.config['FREEZE_DIR']:
+        freeze(app, app.config['FREEZE_DIR'])
     scheduler.start()
     app.run(host="0.0.0.0", port=5000, debug=True)
@@ -0,0 +1,142 @@
+# keeps the hero / item icons under static/assets/img in sync with the wiki: parallel conditional
+# downloads through the shared fetcher, a file is only rewritten when its content hash changed
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+
+import requests
+
+from db import get_connection, transaction
+from fetcher import get_fetcher
+from migrations import migrate
+
+IMG_DIR = os.path.join("static", "assets", "img")
+CHUNK = 64 * 1024
+
+
+def file_sha1(path):
+    digest = hashlib.sha1()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK), b""):
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+def item_targets(conn):
+    return [(image_url, os.path.join(IMG_DIR, f"{name.replace('_', ' ').lower()}.png"))
+            for name, image_url in conn.execute(
+                "SELECT name, image_url FROM items WHERE image_url IS NOT NULL ORDER BY id")]
+
+
+def hero_targets(conn):
+    return [(image_url, os.path.join(IMG_DIR, f"{name}.png"))
+            for name, image_url in conn.execute(
+                "SELECT name, image_url FROM characters WHERE image_url IS NOT NULL ORDER BY id")]
+
+
+def download(fetcher, url, path, known):
+    # -> (status, assets row); status is "new", "updated", "unchanged" or "error", failures stay per image
+    try:
+        return fetch_to(fetcher, url, path, known)
+    except (requests.RequestException, OSError) as e:
+        print(f"[assetsync] failed to download {url}: {e}")
+        return "error", None
+
+
+def fetch_to(fetcher, url, path, known):
+    on_disk = file_sha1(path)
+    headers = {}
+    # stored validators only describe the file if it is still the one we wrote
+    if known and known["url"] == url and on_disk == known["sha1"]:
+        if known["etag"]:
+            headers["If-None-Match"] = known["etag"]
+        if known["last_modified"]:
+            headers["If-Modified-Since"] = known["last_modified"]
+
+    response = fetcher.get(url, headers=headers, stream=True)
+    if response is None:
+        print(f"[assetsync] failed to download {url}")
+        return "error", None
+
+    with response:
+        if response.status_code not in (200, 304):
+            print(f"[assetsync] failed to download {url}: {response.status_code}")
+            return "error", None
+
+        if response.status_code == 304:
+            return "unchanged", (path, url, known["etag"], known["last_modified"], known["sha1"], known["size"], time.time())
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        digest, size = hashlib.sha1(), 0
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in response.iter_content(CHUNK):
+                    digest.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+            if digest.hexdigest() == on_disk:
+                os.unlink(tmp)
+                status = "unchanged"
+            else:
+                os.replace(tmp, path)
+                status = "updated" if on_disk else "new"
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+    return status, (path, url, response.headers.get("ETag"), response.headers.get("Last-Modified"),
+                    digest.hexdigest(), size, time.time())
+
+
+def sync(targets, fetcher=None):
+    # targets: (url, path) pairs, the first url wins when two point at the same file
+    fetcher = fetcher or get_fetcher()
+    start = time.perf_counter()
+    unique = {}
+    for url, path in targets:
+        unique.setdefault(path, url)
+
+    conn = get_connection()
+    known = {row["path"]: row for row in conn.execute("SELECT * FROM assets")}
+    results = fetcher.map(lambda item: download(fetcher, item[1], item[0], known.get(item[0])), list(unique.items()))
+
+    counts = {"new": 0, "updated": 0, "unchanged": 0, "error": 0}
+    rows = []
+    for status, row in results:
+        counts[status] += 1
+        if row:
+            rows.append(row)
+
+    with transaction() as conn:
+        conn.executemany('''INSERT INTO assets (path, url, etag, last_modified, sha1, size, checked_at)
+                            VALUES (?, ?, ?, ?, ?, ?, ?)
+                            ON CONFLICT (path) DO UPDATE SET url = excluded.url, etag = excluded.etag,
+                                last_modified = excluded.last_modified, sha1 = excluded.sha1,
+                                size = excluded.size, checked_at = excluded.checked_at''', rows)
+
+    print(f"[assetsync] {len(unique)} assets in {time.perf_counter() - start:.2f}s: "
+          + ", ".join(f"{count} {status}" for status, count in counts.items()))
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="download changed hero / item images")
+    parser.add_argument("--items", action="store_true", help="only item icons")
+    parser.add_argument("--heroes", action="store_true", help="only hero portraits")
+    args = parser.parse_args()
+
+    migrate()
+    conn = get_connection()
+    targets = []
+    if args.items or not args.heroes:
+        targets += item_targets(conn)
+    if args.heroes or not args.items:
+        targets += hero_targets(conn)
+    sync(targets)
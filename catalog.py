@@ -0,0 +1,58 @@
+# hero / item catalog writes for heroscrapper and itemscrapper: scraped rows are staged and applied
+# with one executemany upsert per table, keyed on the unique name indexes
+from db import get_connection, transaction
+import lexicon
+
+CHARACTER_COLUMNS = ("name", "ability1", "ability2", "ability3", "ability4", "image_url")
+ITEM_COLUMNS = ("name", "category", "price", "image_url")
+
+
+def stored_rows(table, columns, names):
+    # {name: row in columns order} for the names already in the table, one unique-index lookup each
+    placeholders = ", ".join("?" for _ in names)
+    return {row[0]: tuple(row) for row in get_connection().execute(
+        f"SELECT {', '.join(columns)} FROM {table} WHERE name IN ({placeholders})", names)} if names else {}
+
+
+def upsert(table, columns, rows):
+    # rows are tuples in columns order, None means "not scraped this time" and keeps the stored value;
+    # -> {"inserted": n, "updated": n, "unchanged": n}
+    staged = {}
+    for row in rows:
+        previous = staged.get(row[0], (None,) * len(columns))
+        staged[row[0]] = tuple(new if new is not None else old for new, old in zip(row, previous))
+
+    existing = stored_rows(table, columns, list(staged))
+
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+    changed = []
+    for name, row in staged.items():
+        current = existing.get(name)
+        if current is None:
+            counts["inserted"] += 1
+        elif all(new is None or new == old for new, old in zip(row, current)):
+            counts["unchanged"] += 1
+            continue
+        else:
+            counts["updated"] += 1
+        changed.append(row)
+
+    updates = ", ".join(f"{column} = COALESCE(excluded.{column}, {column})" for column in columns[1:])
+    with transaction() as conn:
+        conn.executemany(f"""INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})
+                             ON CONFLICT (name) DO UPDATE SET {updates}""", changed)
+
+    if changed:
+        # the categorizer rebuilds its matcher and refresh_stale recategorizes against the new catalog
+        lexicon.invalidate()
+    print(f"[catalog] {table}: {counts['inserted']} inserted, {counts['updated']} updated, "
+          f"{counts['unchanged']} unchanged")
+    return counts
+
+
+def sync_characters(rows):
+    return upsert("characters", CHARACTER_COLUMNS, rows)
+
+
+def sync_items(rows):
+    return upsert("items", ITEM_COLUMNS, rows)
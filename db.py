@@ -0,0 +1,229 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import zlib
+from contextlib import contextmanager
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+database = "patch.db"
+
+# WAL lets the scheduler write while web workers keep reading,
+# NORMAL sync is durable enough under WAL and avoids an fsync per commit
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA temp_store = MEMORY",
+    # per connection and off by default, without it changes.patch_id's ON DELETE CASCADE never runs
+    "PRAGMA foreign_keys = ON",
+)
+
+_local = threading.local()
+
+
+def connect(path=None):
+    # database is read at call time, so it can be pointed at another file (tests use a temp db)
+    conn = sqlite3.connect(path or database)
+    conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def get_connection():
+    # one connection per thread, reopened after a fork so gunicorn workers never share one
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.pid != os.getpid():
+        conn = connect()
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
+
+
+@contextmanager
+def transaction():
+    conn = get_connection()
+    with conn:
+        yield conn
+
+
+def close_connection():
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+
+# storage format #######################################################################################################
+
+# content (bbWrapper html) and content_filtered (categorized json) are stored as zlib BLOBs, about a third of
+# the text size; rows written before that are still TEXT, the decoders accept both
+COMPRESSION_LEVEL = 9
+
+
+def encode_text(text):
+    return zlib.compress(text.encode(), COMPRESSION_LEVEL)
+
+
+def decode_text(value):
+    if isinstance(value, bytes):
+        return zlib.decompress(value).decode()
+    return value
+
+
+def encode_structure(structure):
+    # compact json, orjson when it's installed; both read back to the same dict
+    if orjson is not None:
+        data = orjson.dumps(structure)
+    else:
+        data = json.dumps(structure, separators=(",", ":"), ensure_ascii=False).encode()
+    return zlib.compress(data, COMPRESSION_LEVEL)
+
+
+def decode_structure(value):
+    if value is None:
+        return None
+    data = zlib.decompress(value) if isinstance(value, bytes) else value
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+# queries ##############################################################################################################
+
+LISTING_COLUMNS = "id, title, link, timestamp, date, hero_count, weapon_count, spirit_count, vitality_count"
+NEWEST_COLUMNS = "id, title, link, timestamp, date"
+
+
+def get_newest():
+    return get_connection().execute(
+        f"SELECT {NEWEST_COLUMNS} FROM patches WHERE id = (SELECT MAX(id) FROM patches)").fetchone()
+
+
+def get_patches(before=None, limit=20):
+    # keyset pagination on (timestamp, id): every page is an index range scan, however long the history gets
+    conn = get_connection()
+    # listing only needs the precomputed summary, never content / content_filtered
+    if before is None:
+        rows = conn.execute(f"SELECT {LISTING_COLUMNS} FROM patches ORDER BY timestamp DESC, id DESC LIMIT ?",
+                            (limit + 1,)).fetchall()
+    else:
+        rows = conn.execute(f"""SELECT {LISTING_COLUMNS} FROM patches
+                                WHERE (timestamp, id) < (SELECT timestamp, id FROM patches WHERE id = ?)
+                                ORDER BY timestamp DESC, id DESC LIMIT ?""", (before, limit + 1)).fetchall()
+    patches = [dict(patch) for patch in rows]
+
+    # the extra row only tells us whether an older page exists
+    next_cursor = None
+    if len(patches) > limit:
+        patches = patches[:limit]
+        next_cursor = patches[-1]['id']
+
+    return patches, get_newest(), next_cursor
+
+
+def get_timeline(entity_type, entity):
+    # every change to one hero / item, newest patch first, grouped per patch
+    rows = get_connection().execute("""
+        SELECT c.patch_id, p.date, p.timestamp, c.entity, c.category, c.kind, c.line
+        FROM changes c JOIN patches p ON p.id = c.patch_id
+        WHERE c.entity_type = ? AND c.entity = ? COLLATE NOCASE
+        ORDER BY p.timestamp DESC, c.patch_id DESC, c.id""", (entity_type, entity)).fetchall()
+
+    timeline = []
+    for row in rows:
+        if not timeline or timeline[-1]['id'] != row['patch_id']:
+            timeline.append({'id': row['patch_id'], 'date': row['date'], 'timestamp': row['timestamp'],
+                             'entity': row['entity'], 'category': row['category'],
+                             'buff': [], 'nerf': [], 'other': []})
+        timeline[-1][row['kind']].append(row['line'])
+    return timeline
+
+
+def fts_query(text):
+    # quote every word so user input can't break fts5 syntax, prefix-match the last one
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+    return " ".join(f'"{word}"' for word in words) + "*"
+
+
+def search_changes(text, hero=None, item=None, kind=None, limit=50):
+    query = fts_query(text)
+    if query is None:
+        return []
+
+    # matches come back with \x02 / \x03 around the highlighted words
+    sql = """SELECT c.patch_id, p.date, p.timestamp, c.entity_type, c.entity, c.category, c.kind, c.line,
+                    highlight(changes_fts, 0, char(2), char(3)) AS highlight
+             FROM changes_fts
+             JOIN changes c ON c.id = changes_fts.rowid
+             JOIN patches p ON p.id = c.patch_id
+             WHERE changes_fts MATCH ?"""
+    params = [query]
+    if hero:
+        sql += " AND c.entity_type = 'hero' AND c.entity = ? COLLATE NOCASE"
+        params.append(hero)
+    if item:
+        sql += " AND c.entity_type = 'item' AND c.entity = ? COLLATE NOCASE"
+        params.append(item)
+    if kind:
+        sql += " AND c.kind = ?"
+        params.append(kind)
+    sql += " ORDER BY changes_fts.rank LIMIT ?"
+    params.append(limit)
+
+    return [dict(row) for row in get_connection().execute(sql, params).fetchall()]
+
+
+def get_stat_changes(stat=None, kind=None, min_delta=None, since=None, limit=50):
+    # biggest relative changes first, e.g. stat="cooldown", kind="nerf" or stat="damage", min_delta=10;
+    # since is iso text ("2024-05-01"), patches.timestamp is text so an int would match every row
+    sql = """SELECT c.patch_id, p.date, p.timestamp, c.entity_type, c.entity, c.category, c.kind, c.line,
+                    c.stat, c.old_value, c.new_value, c.unit, c.pct_delta
+             FROM changes c
+             JOIN patches p ON p.id = c.patch_id
+             WHERE c.pct_delta IS NOT NULL"""
+    params = []
+    if stat:
+        sql += " AND c.stat = ?"
+        params.append(stat)
+    if kind:
+        sql += " AND c.kind = ?"
+        params.append(kind)
+    if min_delta is not None:
+        sql += " AND abs(c.pct_delta) >= ?"
+        params.append(min_delta)
+    if since is not None:
+        sql += " AND p.timestamp >= ?"
+        params.append(since)
+    sql += " ORDER BY abs(c.pct_delta) DESC LIMIT ?"
+    params.append(limit)
+
+    return [dict(row) for row in get_connection().execute(sql, params).fetchall()]
+
+
+def get_patch_by_id(patch_id):
+    # the patch and the "newest" row in one round trip
+    row = get_connection().execute("""
+        SELECT p.id, p.title, p.content, p.content_filtered, p.link, p.timestamp, p.date,
+               n.id AS newest_id, n.title AS newest_title, n.link AS newest_link,
+               n.timestamp AS newest_timestamp, n.date AS newest_date
+        FROM patches p, patches n
+        WHERE p.id = ? AND n.id = (SELECT MAX(id) FROM patches)""", (patch_id,)).fetchone()
+
+    if row is None:
+        return None
+
+    patch = dict(row)
+    newest = {key[len("newest_"):]: patch.pop(key) for key in list(patch) if key.startswith("newest_")}
+    patch['content'] = decode_text(patch['content'])
+    if patch['content_filtered']:
+        patch['content_filtered'] = decode_structure(patch['content_filtered'])
+    return patch, newest
@@ -1,7 +1,7 @@
-import sqlite3
+from db import connect
 
-# connect to your database
-conn = sqlite3.connect('patch.db')
+# connect to your database (db.connect turns foreign keys on, so the patches' changes go with them)
+conn = connect()
 cursor = conn.cursor()
 
 
@@ -0,0 +1,186 @@
+# shared http session for the scrapers: pooled keep-alive connections, timeouts, retries
+# and a per-host rate limit, so concurrent fetches stay polite to the forum / wiki
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.util.retry import Retry
+
+USER_AGENT = "cursedapple-scrapper (+https://github.com/nokocu/cursedapple)"
+TIMEOUT = (5, 20)    # connect, read
+WORKERS = 8
+
+# FETCH_MODE:
+#   live    every request hits the network (default)
+#   cache   serve stored responses younger than FETCH_CACHE_TTL seconds, fetch and store the rest
+#   record  always hit the network, store every successful response
+#   replay  never hit the network, serve stored responses only (offline parser work / benchmarks)
+MODES = ("live", "cache", "record", "replay")
+CACHE_DIR = os.environ.get("FETCH_CACHE_DIR", ".fetchcache")
+CACHE_TTL = float(os.environ.get("FETCH_CACHE_TTL", 3600))
+KEPT_HEADERS = ("Content-Type", "ETag", "Last-Modified")
+
+
+def atomic_write(path, data):
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        # mkstemp creates 0600, the static build / export output has to be readable by the web server
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class ResponseStore:
+    # bodies are stored once per content hash (zlib), urls/<sha1 of url>.json points at them,
+    # so a page that didn't change between recordings costs no extra space
+    def __init__(self, root=CACHE_DIR):
+        self.root = root
+
+    def _url_path(self, url):
+        return os.path.join(self.root, "urls", hashlib.sha1(url.encode()).hexdigest() + ".json")
+
+    def _body_path(self, digest):
+        return os.path.join(self.root, "objects", digest[:2], digest + ".z")
+
+    def load(self, url, ttl=None):
+        try:
+            with open(self._url_path(url), encoding="utf-8") as f:
+                entry = json.load(f)
+            if ttl is not None and time.time() - entry["fetched_at"] > ttl:
+                return None
+            with open(self._body_path(entry["body"]), "rb") as f:
+                body = zlib.decompress(f.read())
+        except (OSError, ValueError, KeyError, zlib.error):
+            return None
+
+        response = requests.Response()
+        response.url = url
+        response.status_code = entry["status"]
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response.encoding = entry.get("encoding")
+        response._content = body
+        # no raw connection behind it: iter_content / close work off _content
+        response._content_consumed = True
+        return response
+
+    def urls(self):
+        # every stored url, e.g. to rerun parsers over a recording
+        try:
+            names = sorted(os.listdir(os.path.join(self.root, "urls")))
+        except OSError:
+            return []
+        urls = []
+        for name in names:
+            try:
+                with open(os.path.join(self.root, "urls", name), encoding="utf-8") as f:
+                    urls.append(json.load(f)["url"])
+            except (OSError, ValueError, KeyError):
+                continue
+        return urls
+
+    def save(self, url, response):
+        body = response.content
+        digest = hashlib.sha1(body).hexdigest()
+        body_path = self._body_path(digest)
+        if not os.path.exists(body_path):
+            atomic_write(body_path, zlib.compress(body, 6))
+        entry = {
+            "url": url,
+            "status": response.status_code,
+            "headers": {name: response.headers[name] for name in KEPT_HEADERS if name in response.headers},
+            "encoding": response.encoding,
+            "body": digest,
+            "fetched_at": time.time(),
+        }
+        atomic_write(self._url_path(url), json.dumps(entry).encode())
+
+
+class RateLimiter:
+    # hands out evenly spaced request slots per host, callers sleep outside the lock
+    def __init__(self, per_second):
+        self.interval = 1 / per_second if per_second else 0
+        self._next = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url):
+        if not self.interval:
+            return
+        host = urlsplit(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next.get(host, now))
+            self._next[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class Fetcher:
+    def __init__(self, workers=WORKERS, per_second=10, retries=3, timeout=TIMEOUT, mode=None, store=None):
+        self.mode = mode or os.environ.get("FETCH_MODE", "live")
+        if self.mode not in MODES:
+            raise ValueError(f"unknown FETCH_MODE {self.mode!r}, expected one of {', '.join(MODES)}")
+        self.store = store or ResponseStore()
+        self.workers = workers
+        self.timeout = timeout
+        self.limiter = RateLimiter(per_second)
+
+        retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=("GET", "HEAD"), respect_retry_after_header=True)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=workers, max_retries=retry)
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def get(self, url, **kwargs):
+        # None on connection errors / exhausted retries / replay misses, callers check status_code like before
+        if self.mode in ("cache", "replay"):
+            response = self.store.load(url, ttl=CACHE_TTL if self.mode == "cache" else None)
+            if response is not None:
+                return response
+            if self.mode == "replay":
+                print(f"[fetcher] {url} not recorded, replay mode never hits the network")
+                return None
+
+        self.limiter.wait(url)
+        try:
+            response = self.session.get(url, timeout=kwargs.pop("timeout", self.timeout), **kwargs)
+        except requests.RequestException as e:
+            print(f"[fetcher] {url} failed: {e}")
+            return None
+
+        if self.mode in ("cache", "record") and response.status_code == 200:
+            self.store.save(url, response)
+        return response
+
+    def map(self, fn, urls):
+        # fn(url) over a bounded thread pool, results in the order of urls
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            return list(pool.map(fn, urls))
+
+
+_fetcher = None
+_lock = threading.Lock()
+
+
+def get_fetcher():
+    global _fetcher
+    with _lock:
+        if _fetcher is None:
+            _fetcher = Fetcher()
+        return _fetcher
@@ -0,0 +1,149 @@
+# static export: renders the listing pages, every patch note and the /api/patches pages through the flask app
+# into a directory nginx / a CDN can serve as-is. the hashed assets from staticbuild are copied along, and a rerun
+# only rewrites the pages whose rendered output changed (a new patch touches the index, the new post and the
+# previous newest post's NEWEST tab).
+# query-driven routes have no file to export: /search (the header's SEARCH link), /api/search, /api/changes,
+# the /hero/<name> and /item/<name> timelines linked from search results, and /api/patches?before=&limit=
+# (the exported pages link each other through /api/before/<cursor>); proxy those to the app if needed
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+
+from fetcher import atomic_write
+from migrations import migrate
+from db import get_connection, get_patches
+from staticbuild import build, STATIC_DIR, BUILD_DIR
+from imagevariants import build as build_variants
+from sprites import build as build_sprites
+
+OUT_DIR = "site"
+TEMPLATE_DIR = "templates"
+STATE_FILE = ".freeze.json"
+
+
+def content_hash(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def publish_assets(out_dir, build_dir=BUILD_DIR):
+    # hashed names (and their .gz / .br siblings) never change content, so only new files are copied
+    written = 0
+    for root, _, files in os.walk(build_dir):
+        for name in files:
+            rel = os.path.relpath(os.path.join(root, name), STATIC_DIR)
+            target = os.path.join(out_dir, "static", rel)
+            if name not in ("manifest.json", "retired.json") and not os.path.exists(target):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.copyfile(os.path.join(root, name), target)
+                written += 1
+    return written
+
+
+def site_fingerprint(manifest):
+    # templates or assets changing means every page has to be rendered again
+    digest = hashlib.sha1(json.dumps(manifest, sort_keys=True).encode())
+    for root, _, files in sorted(os.walk(TEMPLATE_DIR)):
+        for name in sorted(files):
+            with open(os.path.join(root, name), "rb") as f:
+                digest.update(name.encode() + f.read())
+    return digest.hexdigest()
+
+
+def output_path(out_dir, url):
+    # /patchnote/5 -> patchnote/5/index.html, /api/patches -> api/patches (served as application/json)
+    if url.startswith("/api/"):
+        return os.path.join(out_dir, url.strip("/"))
+    return os.path.join(out_dir, url.strip("/"), "index.html")
+
+
+def patch_stamps(conn):
+    # everything a post page renders from: the content / categorizer state plus whether it is the newest
+    newest = conn.execute("SELECT MAX(id) FROM patches").fetchone()[0]
+    return {f"/patchnote/{id}": content_hash(json.dumps([title, timestamp, date, hash_, version, id == newest]).encode())
+            for id, title, timestamp, date, hash_, version in conn.execute(
+                "SELECT id, title, timestamp, date, content_hash, filter_version FROM patches")}
+
+
+def listing_urls(page_size):
+    # the home page and every /before/<cursor> page it links to, following the keyset cursors,
+    # with the /api/patches pages their json "next" links walk through
+    urls, cursor = ["/", "/api/patches"], None
+    while True:
+        _, _, cursor = get_patches(cursor, page_size)
+        if cursor is None:
+            return urls
+        urls += [f"/before/{cursor}", f"/api/before/{cursor}"]
+
+
+def load_state(out_dir):
+    try:
+        with open(os.path.join(out_dir, STATE_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"site": None, "stamps": {}, "pages": {}}
+
+
+def freeze(app, out_dir=OUT_DIR, full=False):
+    start = time.perf_counter()
+    state = load_state(out_dir)
+    # variants / sheets first, staticbuild hashes them along with the rest of static/
+    build_variants()
+    build_sprites()
+    manifest = build()
+    assets = publish_assets(out_dir)
+    site = site_fingerprint(manifest)
+    full = full or state["site"] != site
+
+    stamps = patch_stamps(get_connection())
+    posts = [url for url, stamp in stamps.items() if full or state["stamps"].get(url) != stamp]
+    # listings and their json pages are cheap (no note content) and shift on every new patch
+    urls = listing_urls(app.config['PAGE_SIZE']) + sorted(posts, key=lambda url: int(url.rsplit("/", 1)[1]))
+
+    pages = dict(state["pages"])
+    written = 0
+    client = app.test_client()
+    for url in urls:
+        response = client.get(url)
+        if response.status_code != 200:
+            print(f"[freeze] {url} returned {response.status_code}, skipped")
+            if url in stamps:
+                # rendered again on the next run
+                stamps[url] = None
+            continue
+        body = response.get_data()
+        digest = content_hash(body)
+        path = output_path(out_dir, url)
+        if pages.get(url) != digest or not os.path.exists(path):
+            atomic_write(path, body)
+            written += 1
+        pages[url] = digest
+
+    # pages for patches that are gone, and listing cursors no longer linked from the home page
+    live = set(urls) | set(stamps)
+    removed = 0
+    for url in [url for url in pages if url not in live]:
+        try:
+            os.unlink(output_path(out_dir, url))
+        except FileNotFoundError:
+            pass
+        del pages[url]
+        removed += 1
+
+    atomic_write(os.path.join(out_dir, STATE_FILE),
+                 json.dumps({"site": site, "stamps": stamps, "pages": pages}, sort_keys=True).encode())
+    print(f"[freeze] {len(urls)} pages rendered, {written} written, {removed} removed, {assets} new assets "
+          f"in {time.perf_counter() - start:.2f}s -> {out_dir}")
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="render the site into a static directory")
+    parser.add_argument("out", nargs="?", default=OUT_DIR, help="output directory")
+    parser.add_argument("--full", action="store_true", help="render every page, not only the changed ones")
+    args = parser.parse_args()
+    migrate()
+    from app import app
+    freeze(app, args.out, args.full)
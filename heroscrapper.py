@@ -1,6 +1,8 @@
-import requests
-from bs4 import BeautifulSoup
-import sqlite3
+from fetcher import get_fetcher
+from migrations import migrate
+from parsing import make_soup, HERO_PAGE
+from assetsync import sync, IMG_DIR
+from catalog import sync_characters
 import urllib.parse  # For decoding URL-encoded characters
 import os  # For working with the file system
 
@@ -8,82 +10,17 @@ import os  # For working with the file system
 os.makedirs('static/assets/img', exist_ok=True)
 
 
-def init_db():
-    conn = sqlite3.connect("patch.db")
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS characters (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT,
-                    ability1 TEXT,
-                    ability2 TEXT,
-                    ability3 TEXT,
-                    ability4 TEXT,
-                    image_url TEXT
-                 )''')
-    conn.commit()
-    conn.close()
-
-
-def save_character(name, ability1, ability2, ability3, ability4, image_url=None):
-    conn = sqlite3.connect("patch.db")
-    c = conn.cursor()
-
-    # check if the character already exists
-    c.execute('SELECT id FROM characters WHERE name = ?', (name,))
-    existing_character = c.fetchone()
-
-    if existing_character:
-        # update the image_url if the character exists
-        c.execute('''UPDATE characters 
-                     SET image_url = ? 
-                     WHERE name = ?''', (image_url, name))
-        print(f"Updated image for {name}")
-    else:
-        # insert a new record if the character doesn't exist
-        c.execute('''INSERT INTO characters 
-                    (name, ability1, ability2, ability3, ability4, image_url) 
-                    VALUES (?, ?, ?, ?, ?, ?)''',
-                  (name, ability1, ability2, ability3, ability4, image_url))
-        print(f"Inserted new character {name}")
-
-    conn.commit()
-    conn.close()
-
-
-def download_image(image_url, hero_name):
-    # extract the image file extension from the URL
-    file_name = f"{hero_name}.png"
-    image_path = os.path.join("static", "assets", "img", file_name)
-
-    try:
-        # download
-        response = requests.get(image_url, stream=True)
-
-        if response.status_code == 200:
-            # save the image to the file path
-            with open(image_path, 'wb') as f:
-                for chunk in response.iter_content(1024):
-                    f.write(chunk)
-            print(f"Image saved for {hero_name}")
-            # save relative path for the database
-            return f"/static/assets/img/{file_name}"
-        else:
-            print(f"Failed to download image for {hero_name}: {image_url}")
-            return None
-    except Exception as e:
-        print(f"Error downloading image for {hero_name}: {e}")
-        return None
-
-
 def scrap_characters():
     url = "https://deadlocked.wiki/Hero"
-    response = requests.get(url)
+    response = get_fetcher().get(url)
 
-    if response.status_code != 200:
+    if response is None or response.status_code != 200:
         print(f"[scrap_characters] Failed to fetch the hero page: {url}")
         return
 
-    soup = BeautifulSoup(response.text, 'html.parser')
+    soup = make_soup(response.text, HERO_PAGE)
+
+    rows = []
 
     # extract character abilities
     tbody_elements = soup.find_all('tbody')[:-2]
@@ -107,18 +44,22 @@ def scrap_characters():
                 print(f"Found character: {character_name}")
                 print(f"Abilities: {ability1}, {ability2}, {ability3}, {ability4}")
 
-                save_character(character_name, ability1, ability2, ability3, ability4)
+                rows.append((character_name, ability1, ability2, ability3, ability4, None))
+
+    sync_characters(rows)
 
 
 def scrap_images():
     url = "https://deadlocked.wiki/Hero"
-    response = requests.get(url)
+    response = get_fetcher().get(url)
 
-    if response.status_code != 200:
+    if response is None or response.status_code != 200:
         print(f"[scrap_images] Failed to fetch the hero page: {url}")
         return
 
-    soup = BeautifulSoup(response.text, 'html.parser')
+    soup = make_soup(response.text, HERO_PAGE)
+
+    targets, rows = [], []
 
     # target the last two tbody elements
     tbody_elements = soup.find_all('tbody')[-2:]  # Only the last two tbody elements for images
@@ -144,12 +85,16 @@ def scrap_images():
                 if hero_image_tag:
                     hero_image_url = "https://deadlocked.wiki/" + hero_image_tag['src']
 
-                    # download and update
-                    download_image(hero_image_url, hero_name)
-                    save_character(hero_name, None, None, None, None, hero_image_url)
+                    targets.append((hero_image_url, os.path.join(IMG_DIR, f"{hero_name}.png")))
+                    rows.append((hero_name, None, None, None, None, hero_image_url))
+
+    sync_characters(rows)
+
+    # download new / changed portraits in parallel
+    sync(targets)
 
 
 if __name__ == "__main__":
-    init_db()
+    migrate()
     scrap_characters()
     scrap_images()
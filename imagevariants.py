@@ -0,0 +1,157 @@
+# resized WebP / AVIF copies of the raster images under static/assets, written to static/variants so
+# staticbuild hashes them like any other asset. Pillow is optional: without it (or without AVIF support)
+# the missing formats are skipped and picture() falls back to the original file
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import quote
+
+from markupsafe import Markup, escape
+
+from assetsync import file_sha1
+from fetcher import atomic_write
+from staticbuild import asset_url, build as build_assets
+
+try:
+    from PIL import Image, features
+    # method 6 / the default avif speed cost ~10x the encode time for a few % smaller files
+    FORMATS = {"webp": ("WEBP", {"quality": 80, "method": 4})}
+    if features.check("avif"):
+        FORMATS["avif"] = ("AVIF", {"quality": 55, "speed": 8})
+except ImportError:
+    Image = None
+    FORMATS = {}
+
+STATIC_DIR = "static"
+SOURCE_DIR = os.path.join(STATIC_DIR, "assets")
+INDEX = ".imagevariants.json"
+# target widths, capped at the source width, which is always included for 2x screens
+WIDTHS = (32, 64, 128, 256, 480, 960)
+SOURCE_TYPES = (".png", ".jpg", ".jpeg")
+# preferred first, the browser takes the first <source> type it supports
+ORDER = ("avif", "webp")
+
+_index = {"mtime": None, "images": {}}
+
+
+def variant_path(rel, width, fmt):
+    root, _ = os.path.splitext(rel)
+    return f"variants/{root}.{width}.{fmt}"
+
+
+def process(rel, formats):
+    # runs in a worker: every variant of one image -> (rel, width, height, {fmt: [widths]})
+    with Image.open(os.path.join(STATIC_DIR, rel)) as image:
+        image.load()
+        width, height = image.size
+        image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+        widths = [w for w in WIDTHS if w < width] + [width]
+        written = {}
+        for fmt in formats:
+            pil_format, options = FORMATS[fmt]
+            for w in widths:
+                resized = image if w == width else image.resize((w, max(1, round(height * w / width))), Image.LANCZOS)
+                path = os.path.join(STATIC_DIR, variant_path(rel, w, fmt))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                resized.save(path, pil_format, **options)
+            written[fmt] = widths
+    return rel, width, height, written
+
+
+def load_index(path=INDEX):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def build(workers=None, force=False):
+    # only sources whose size / mtime moved and whose content hash changed are encoded again
+    if Image is None:
+        print("[imagevariants] Pillow is not installed, no image variants")
+        return load_index()
+
+    start = time.perf_counter()
+    index = {} if force else load_index()
+    sources = {}
+    for root, _, files in os.walk(SOURCE_DIR):
+        for name in files:
+            if name.lower().endswith(SOURCE_TYPES):
+                path = os.path.join(root, name)
+                sources[os.path.relpath(path, STATIC_DIR).replace(os.sep, "/")] = path
+
+    todo, stamps = [], {}
+    for rel, path in sources.items():
+        stat = os.stat(path)
+        entry = index.get(rel)
+        stamp = [stat.st_size, stat.st_mtime_ns]
+        missing = [fmt for fmt in FORMATS if not entry or fmt not in entry["variants"]
+                   or not all(os.path.exists(os.path.join(STATIC_DIR, variant_path(rel, w, fmt)))
+                              for w in entry["variants"][fmt])]
+        if entry and entry["stamp"] == stamp and not missing:
+            continue
+        sha1 = file_sha1(path)
+        stamps[rel] = (stamp, sha1)
+        if entry and entry["sha1"] == sha1 and not missing:
+            entry["stamp"] = stamp
+            continue
+        todo.append(rel)
+
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for rel, width, height, written in pool.map(process, todo, [list(FORMATS)] * len(todo), chunksize=8):
+                stamp, sha1 = stamps[rel]
+                index[rel] = {"stamp": stamp, "sha1": sha1, "width": width, "height": height, "variants": written}
+
+    # sources that are gone take their variants with them
+    removed = 0
+    for rel in [rel for rel in index if rel not in sources]:
+        for fmt, widths in index.pop(rel)["variants"].items():
+            for w in widths:
+                try:
+                    os.unlink(os.path.join(STATIC_DIR, variant_path(rel, w, fmt)))
+                except FileNotFoundError:
+                    pass
+        removed += 1
+
+    atomic_write(INDEX, json.dumps(index, indent=1, sort_keys=True).encode())
+    print(f"[imagevariants] {len(sources)} images, {len(todo)} encoded ({', '.join(FORMATS)}), {removed} removed "
+          f"in {time.perf_counter() - start:.2f}s")
+    return index
+
+
+def picture(path, width=None, alt="", **attrs):
+    # template helper: picture('assets/img/abrams.png', 88) -> <picture> with avif / webp srcsets for a
+    # 88 css px slot and an <img> of the original carrying width / height, so the layout never shifts
+    try:
+        mtime = os.stat(INDEX).st_mtime_ns
+    except OSError:
+        mtime = None
+    if mtime != _index["mtime"]:
+        _index["images"], _index["mtime"] = load_index(), mtime
+
+    entry = _index["images"].get(path)
+    sources = []
+    if entry:
+        width = width or entry["width"]
+        attrs.update(width=width, height=round(entry["height"] * width / entry["width"]))
+        for fmt in ORDER:
+            if fmt in entry["variants"]:
+                # srcset is whitespace separated, so "mo & krill" has to be percent-encoded here
+                srcset = ", ".join(f"{quote(asset_url(variant_path(path, w, fmt)))} {w}w" for w in entry["variants"][fmt])
+                sources.append(f'<source type="image/{fmt}" srcset="{escape(srcset)}" sizes="{width}px">')
+    attributes = "".join(f' {name.rstrip("_")}="{escape(value)}"' for name, value in attrs.items())
+    return Markup(f'<picture>{"".join(sources)}<img src="{escape(asset_url(path))}" alt="{escape(alt)}"{attributes}></picture>')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="encode resized webp / avif variants of static/assets images")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--all", action="store_true", help="encode every image again")
+    args = parser.parse_args()
+    build(args.workers, args.all)
+    # so asset_url / picture() pick the new variants up
+    build_assets()
@@ -1,73 +1,25 @@
-import requests
-from bs4 import BeautifulSoup
-import sqlite3
+from db import get_connection
+from fetcher import get_fetcher
+from migrations import migrate
+from parsing import make_soup, ITEM_PAGE
+from assetsync import sync, item_targets
+from catalog import sync_items
 import os
 
 # directory
 os.makedirs('static/assets/img', exist_ok=True)
 
 
-# initialize the db
-def init_db():
-    conn = sqlite3.connect("patch.db")
-    c = conn.cursor()
-
-    c.execute('''CREATE TABLE IF NOT EXISTS items (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT,
-                    category TEXT,
-                    price TEXT,
-                    image_url TEXT
-                 )''')
-    conn.commit()
-    conn.close()
-
-
-# save item to the db
-def save_item(name, category, price, image_url):
-    conn = sqlite3.connect("patch.db")
-    c = conn.cursor()
-
-    c.execute("INSERT INTO items (name, category, price, image_url) VALUES (?, ?, ?, ?)",
-              (name, category, price, image_url))
-    conn.commit()
-    conn.close()
-
-
-# download images if they dont exist in the folder
-def download_image(image_url, item_name):
-    # generate the image file
-    file_name = f"{item_name.replace('_', ' ').lower()}.png"
-    image_path = os.path.join("static", "assets", "img", file_name)
-
-    try:
-        # download
-        response = requests.get(image_url, stream=True)
-        if response.status_code == 200:
-            # save
-            with open(image_path, 'wb') as f:
-                for chunk in response.iter_content(1024):
-                    f.write(chunk)
-            print(f"Image saved for {item_name}: {image_path}")
-            return image_url
-        else:
-            print(f"Failed to download image for {item_name}: {image_url}")
-            return None
-    except Exception as e:
-        print(f"Error downloading image for {item_name}: {e}")
-        return None
-
-
 # function to scrape items from the website
 def scrap_items():
     url = "https://deadlocked.wiki/Item"
-    response = requests.get(url)
+    response = get_fetcher().get(url)
 
-    if response.status_code != 200:
-        print(f"[ERROR] Failed to fetch the page. Status code: {response.status_code}")
+    if response is None or response.status_code != 200:
+        print(f"[ERROR] Failed to fetch the page: {url}")
         return
 
-    soup = BeautifulSoup(response.text, 'html.parser')
+    soup = make_soup(response.text, ITEM_PAGE)
     tables = soup.find_all("table", class_="navbox")[:3]
     categories = ["Weapon", "Vitality", "Spirit"]
 
@@ -75,6 +27,7 @@ def scrap_items():
         print("[ERROR] No categories found on the page!")
         return
 
+    rows = []
     for i, table in enumerate(tables):
         category = categories[i] if i < len(categories) else f"Unknown Category {i + 1}"
         items = table.find_all("div", class_="HeroCard2")
@@ -90,58 +43,30 @@ def scrap_items():
                     image_url = f"https://deadlocked.wiki{image_src}" if not image_src.startswith("http") else image_src
 
                     if image_url:
-                        save_item(name, category, price, image_url)
-                        print(f"[INFO] Saved item: {name} (Category: {category})")
+                        rows.append((name, category, price, image_url))
+                        print(f"[INFO] Found item: {name} (Category: {category})")
                 else:
                     print(f"[ERROR] No image found for {name}")
             except Exception as e:
                 print(f"[ERROR] Failed to process item: {e}")
 
+    sync_items(rows)
 
-# check if an item already exists
-def item_exists(name):
-    conn = sqlite3.connect("patch.db")
-    c = conn.cursor()
-
-    c.execute("SELECT 1 FROM items WHERE name = ?", (name,))
-    exists = c.fetchone() is not None
-    conn.close()
-
-    return exists
 
-
-# add missing items
+# add items the wiki scrape misses
 def add_missing_items(missing_items):
-    for name, details in missing_items.items():
-        if not item_exists(name):
-            category = details["Category"]
-            price = details["Price"]
-            image = details["Image"]
-            save_item(name, category, price, image)
-            print(f"[INFO] Saved missing item: {name} (Category: {category}, Price: {price})")
-        else:
-            print(f"[INFO] Missing item '{name}' already exists in the database.")
-
-
-# scrape images only (without redownloading)
-def scrap_images():
-    conn = sqlite3.connect("patch.db")
-    c = conn.cursor()
+    sync_items([(name, details["Category"], details["Price"], details["Image"])
+                for name, details in missing_items.items()])
 
-    c.execute("SELECT name, image_url FROM items WHERE image_url IS NOT NULL")
-    items = c.fetchall()
 
-    for name, image_url in items:
-        if image_url:
-            image_url = download_image(image_url, name)
-        else:
-            print(f"[ERROR] No image URL found for {name}")
-    conn.close()
+# download new / changed images only
+def scrap_images():
+    sync(item_targets(get_connection()))
 
 
 # main
 if __name__ == "__main__":
-    init_db()
+    migrate()
     scrap_items()
     missing_items = {
         "Soul Rebirth": {"Category": "Vitality",
@@ -0,0 +1,69 @@
+# heroes / items / abilities the categorizer matches against, loaded on first use and
+# rebuilt whenever the characters or items tables change (e.g. after heroscrapper / itemscrapper runs)
+import hashlib
+import threading
+
+from db import get_connection
+from matcher import EntityMatcher
+
+
+class Lexicon:
+    def __init__(self, character_rows, item_rows, version):
+        self.version = version
+
+        self.characters = [name for name, *abilities in character_rows]
+        self.char_abilities = {name: abilities for name, *abilities in character_rows}
+
+        self.items = {"Weapon": [], "Spirit": [], "Vitality": []}
+        for item_name, category in item_rows:
+            if category not in self.items:
+                self.items[category] = []
+            self.items[category].append(item_name)
+
+        # precompiled once per version, shared by every categorize call
+        self.matcher = EntityMatcher(self.characters, self.items, self.char_abilities)
+
+    def empty_structure(self):
+        return {
+            "[ Heroes ]": {hero: {"buff": [], "nerf": [], "other": []} for hero in self.characters},
+            "[ Items ]": {category: {item: {"buff": [], "nerf": [], "other": []} for item in item_list}
+                          for category, item_list in self.items.items()},
+            "[ Gallery ]": [], "[ Hidden ]": []
+        }
+
+
+def load_rows(conn):
+    character_rows = [tuple(row) for row in conn.execute(
+        "SELECT name, ability1, ability2, ability3, ability4 FROM characters ORDER BY id")]
+    item_rows = [tuple(row) for row in conn.execute("SELECT name, category FROM items ORDER BY id")]
+    return character_rows, item_rows
+
+
+def fingerprint(character_rows, item_rows):
+    digest = hashlib.sha1()
+    for row in character_rows + item_rows:
+        digest.update(repr(row).encode())
+    return digest.hexdigest()[:12]
+
+
+_lexicon = None
+_lock = threading.Lock()
+
+
+def get_lexicon(conn=None):
+    # a few hundred small rows, cheap enough to re-read and hash on every call
+    global _lexicon
+    character_rows, item_rows = load_rows(conn or get_connection())
+    version = fingerprint(character_rows, item_rows)
+    with _lock:
+        if _lexicon is None or _lexicon.version != version:
+            _lexicon = Lexicon(character_rows, item_rows, version)
+            print(f"[lexicon] loaded version {version}: {len(_lexicon.characters)} heroes, "
+                  f"{sum(len(item_list) for item_list in _lexicon.items.values())} items")
+        return _lexicon
+
+
+def invalidate():
+    global _lexicon
+    with _lock:
+        _lexicon = None
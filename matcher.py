@@ -0,0 +1,141 @@
+# single-pass entity matching for newfiltering.categorize
+from collections import deque
+
+# pattern kinds, the order of the checks in categorize
+ITEM_COLON = 0
+HERO_QUOTE = 1
+HERO_COLON = 2
+ITEM = 3
+HERO = 4
+ABILITY = 5
+IGNORE = 6
+
+
+class AhoCorasick:
+    # finds every occurrence of every pattern (overlaps included) in one scan of the text
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+
+        for pattern, payload in patterns:
+            node = 0
+            for char in pattern:
+                next_node = self.goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self.goto)
+                    self.goto[node][char] = next_node
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                node = next_node
+            self.out[node].append(payload)
+
+        # breadth first, so every fail target is finished before its dependants
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                state = self.fail[node]
+                while state and char not in self.goto[state]:
+                    state = self.fail[state]
+                self.fail[child] = self.goto[state].get(char, 0)
+                self.out[child] = self.out[child] + self.out[self.fail[child]]
+
+        self.out = [tuple(payloads) for payloads in self.out]
+
+    def find(self, text):
+        goto, fail, out = self.goto, self.fail, self.out
+        found = set()
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if out[node]:
+                found.update(out[node])
+        return found
+
+
+class EntityMatcher:
+    # built once per lexicon; keeps the precedence of the old per-entity loops:
+    # "item:", then "hero:" (a quoted hero name cancels it), then item, then hero, then ability mentions
+    def __init__(self, characters, items, char_abilities,
+                 ignore_words=("long range", "hero labs"), mistyped_dict=None):
+        self.mistyped = [(mistyped.lower(), correct)
+                         for correct, mistyped_list in (mistyped_dict or {"knockdown": {"Knock Down"}}).items()
+                         for mistyped in mistyped_list]
+
+        self.results = []
+        patterns = []
+
+        def add(pattern, kind, rank, result=None):
+            patterns.append((pattern, (kind, rank, len(self.results))))
+            self.results.append(result)
+
+        rank = 0
+        for category, item_list in items.items():
+            for item in item_list:
+                item_lower = item.lower()
+                add(f"{item_lower}:", ITEM_COLON, rank, ("item", category, item))
+                add(item_lower, ITEM, rank, ("item", category, item))
+                rank += 1
+
+        for rank, hero in enumerate(characters):
+            add(f'{hero}"', HERO_QUOTE, rank)
+            add(f'"{hero}', HERO_QUOTE, rank)
+            add(f"{hero}:", HERO_COLON, rank, ("hero", hero))
+            add(hero, HERO, rank, ("hero", hero))
+
+        rank = 0
+        for hero, abilities in char_abilities.items():
+            for ability in abilities:
+                if ability is None:
+                    continue
+                add(ability.lower(), ABILITY, rank, ("hero", hero))
+                rank += 1
+
+        for word in ignore_words:
+            add(word, IGNORE, 0)
+
+        # an empty pattern is "in" every line
+        self.always = {payload for pattern, payload in patterns if not pattern}
+        self.automaton = AhoCorasick([(pattern, payload) for pattern, payload in patterns if pattern])
+
+    def match(self, line):
+        line_lower = line.lower()
+
+        # handle mistyped items
+        for mistyped, correct in self.mistyped:
+            if mistyped in line_lower:
+                line_lower = line_lower.replace(mistyped, correct)
+
+        found = self.automaton.find(line_lower)
+        found.update(self.always)
+        if not found:
+            return None
+
+        best = {}
+        for kind, rank, index in found:
+            if kind not in best or rank < best[kind][0]:
+                best[kind] = (rank, kind, index)
+
+        if ITEM_COLON in best:
+            return self.results[best[ITEM_COLON][2]]
+
+        # first hero with either form wins, quoted names (example: "you are perfection", Haze) mean no match
+        hero_forms = [best[kind] for kind in (HERO_QUOTE, HERO_COLON) if kind in best]
+        if hero_forms:
+            rank, kind, index = min(hero_forms)
+            return None if kind == HERO_QUOTE else self.results[index]
+
+        if IGNORE not in best:
+            for kind in (ITEM, HERO):
+                if kind in best:
+                    return self.results[best[kind][2]]
+
+        if ABILITY in best:
+            return self.results[best[ABILITY][2]]
+
+        return None
@@ -0,0 +1,287 @@
+# the whole patch.db schema, versioned with PRAGMA user_version; entry points call migrate() once at startup
+# every step is idempotent, so databases created by the old per-module init_db()s (user_version 0) upgrade in place
+import argparse
+import threading
+import time
+
+from db import get_connection, encode_text, encode_structure, decode_structure
+from newfiltering import save_summary, save_changes, SUMMARY_COLUMNS
+
+
+def add_missing_columns(conn, table, columns):
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    for column, column_type in columns.items():
+        if column not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+
+def patches_schema(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS patches (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    title TEXT,
+                    content TEXT,
+                    content_filtered TEXT,
+                    link TEXT,
+                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    date TEXT,
+                    hero_count INTEGER,
+                    weapon_count INTEGER,
+                    spirit_count INTEGER,
+                    vitality_count INTEGER,
+                    gallery_count INTEGER,
+                    hidden_count INTEGER,
+                    content_hash TEXT,
+                    filter_version TEXT
+                 )''')
+
+    # summary / dirty-tracking columns, then summaries for patches categorized before they existed
+    add_missing_columns(conn, "patches", {**{column: "INTEGER" for column in SUMMARY_COLUMNS},
+                                          "content_hash": "TEXT", "filter_version": "TEXT"})
+    rows = conn.execute("SELECT id, content_filtered FROM patches WHERE content_filtered IS NOT NULL AND hero_count IS NULL")
+    cursor = conn.cursor()
+    for patch_id, content_filtered in rows.fetchall():
+        save_summary(cursor, patch_id, decode_structure(content_filtered))
+
+    # known-link lookups for the updater / backfill; not unique, older databases hold some threads twice
+    # and their ids are already public patchnote urls
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_patches_link ON patches (link)")
+
+    # covering index for the keyset-paginated listing
+    conn.execute('''CREATE INDEX IF NOT EXISTS idx_patches_listing ON patches (
+                    timestamp, id, title, link, date, hero_count, weapon_count, spirit_count, vitality_count
+                 )''')
+
+
+def changes_schema(conn):
+    # normalized categorized lines for the hero / item timelines and stat queries
+    conn.execute('''CREATE TABLE IF NOT EXISTS changes (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    patch_id INTEGER NOT NULL REFERENCES patches(id) ON DELETE CASCADE,
+                    entity_type TEXT NOT NULL,
+                    entity TEXT,
+                    category TEXT,
+                    kind TEXT,
+                    line TEXT NOT NULL,
+                    stat TEXT,
+                    old_value REAL,
+                    new_value REAL,
+                    unit TEXT,
+                    pct_delta REAL
+                 )''')
+    add_missing_columns(conn, "changes", {"stat": "TEXT", "old_value": "REAL", "new_value": "REAL",
+                                          "unit": "TEXT", "pct_delta": "REAL"})
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_changes_entity ON changes (entity_type, entity COLLATE NOCASE, patch_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_changes_patch ON changes (patch_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_changes_stat ON changes (stat, pct_delta)")
+
+    # fill it from content_filtered for patches categorized before it existed
+    rows = conn.execute('''SELECT id, content_filtered FROM patches p
+                           WHERE content_filtered IS NOT NULL
+                           AND NOT EXISTS (SELECT 1 FROM changes WHERE patch_id = p.id)''')
+    cursor = conn.cursor()
+    for patch_id, content_filtered in rows.fetchall():
+        save_changes(cursor, patch_id, decode_structure(content_filtered))
+
+
+def search_schema(conn):
+    # full-text index over the categorized lines, kept in sync with changes by triggers
+    fts_exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'changes_fts'").fetchone()
+    conn.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS changes_fts USING fts5(
+                    line, entity, content='changes', content_rowid='id', tokenize='porter unicode61'
+                 )''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS changes_fts_insert AFTER INSERT ON changes BEGIN
+                    INSERT INTO changes_fts (rowid, line, entity) VALUES (new.id, new.line, new.entity);
+                 END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS changes_fts_delete AFTER DELETE ON changes BEGIN
+                    INSERT INTO changes_fts (changes_fts, rowid, line, entity)
+                    VALUES ('delete', old.id, old.line, old.entity);
+                 END''')
+    if not fts_exists:
+        rebuild_search_index(conn)
+
+
+def meta_schema(conn):
+    # page cache generation, updater poll state
+    conn.execute('''CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                 )''')
+    conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', ?)", (f"{time.time():.6f}",))
+
+
+def catalog_schema(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS characters (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT,
+                    ability1 TEXT,
+                    ability2 TEXT,
+                    ability3 TEXT,
+                    ability4 TEXT,
+                    image_url TEXT
+                 )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS items (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT,
+                    category TEXT,
+                    price TEXT,
+                    image_url TEXT
+                 )''')
+
+    # earlier item scrapes inserted every item again (with shifted categories), the first row is the right one
+    for table in ("characters", "items"):
+        removed = conn.execute(f"DELETE FROM {table} WHERE id NOT IN (SELECT MIN(id) FROM {table} GROUP BY name)")
+        if removed.rowcount:
+            print(f"[migrate] removed {removed.rowcount} duplicate {table} rows")
+
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_characters_name ON characters (name)")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_items_name ON items (name)")
+
+
+def assets_schema(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS assets (
+                    path TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    sha1 TEXT,
+                    size INTEGER,
+                    checked_at REAL
+                 )''')
+
+
+def compress_content(conn):
+    # TEXT rows from before the compressed format, see db.encode_text / db.encode_structure
+    rows = conn.execute('''SELECT id, content, content_filtered FROM patches
+                           WHERE typeof(content) = 'text' OR typeof(content_filtered) = 'text' ''').fetchall()
+    for patch_id, content, content_filtered in rows:
+        conn.execute("UPDATE patches SET content = ?, content_filtered = ? WHERE id = ?",
+                     (encode_text(content) if isinstance(content, str) else content,
+                      encode_structure(decode_structure(content_filtered)) if isinstance(content_filtered, str)
+                      else content_filtered, patch_id))
+    print(f"[migrate] compressed {len(rows)} patches")
+
+
+def drop_orphaned_changes(conn):
+    # foreign keys used to be off, so deleted patches left their changes (and fts rows, via the trigger) behind
+    deleted = conn.execute("DELETE FROM changes WHERE patch_id NOT IN (SELECT id FROM patches)").rowcount
+    print(f"[migrate] deleted {deleted} orphaned changes")
+
+
+# (user_version, description, step), append only
+MIGRATIONS = [
+    (1, "patches table, summary columns and listing / link indexes", patches_schema),
+    (2, "changes table and its indexes", changes_schema),
+    (3, "full-text search over changes", search_schema),
+    (4, "meta table", meta_schema),
+    (5, "hero / item catalog with unique names", catalog_schema),
+    (6, "asset metadata", assets_schema),
+    (7, "zlib-compressed patch content", compress_content),
+    (8, "changes of deleted patches", drop_orphaned_changes),
+]
+# migrations that free enough pages to be worth a VACUUM afterwards
+VACUUM_AFTER = {7}
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def rebuild_search_index(conn):
+    # bulk rebuild from the changes table, e.g. after restoring a db or changing the tokenizer
+    conn.execute("INSERT INTO changes_fts (changes_fts) VALUES ('rebuild')")
+
+
+_migrated = False
+_lock = threading.Lock()
+
+
+def migrate():
+    global _migrated
+    with _lock:
+        if _migrated:
+            return
+        conn = get_connection()
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+
+        for number, description, step in MIGRATIONS:
+            if number <= version:
+                continue
+            # explicit BEGIN, sqlite3 would otherwise run the DDL outside the transaction
+            with conn:
+                conn.execute("BEGIN")
+                step(conn)
+                conn.execute(f"PRAGMA user_version = {number}")
+            print(f"[migrate] {number}: {description}")
+
+        if any(version < number for number in VACUUM_AFTER):
+            # can't run inside a transaction
+            conn.execute("VACUUM")
+
+        # fresh statistics after a schema change, otherwise only what sqlite thinks is worth re-analyzing
+        conn.execute("ANALYZE" if version < SCHEMA_VERSION else "PRAGMA optimize")
+        _migrated = True
+
+
+# query plans ##########################################################################################################
+
+def hot_queries():
+    # (name, call, allowed): every call runs the real query function, and every SELECT it sends is checked,
+    # so the list can't drift from the sql in db / catalog / lexicon. "allowed" lists the plan steps that are
+    # fine for it (a temp b-tree over one entity's rows, the lexicon reading whole tables); any other SCAN or
+    # temp b-tree is reported.
+    # imported here, most of these modules import migrations themselves
+    import db
+    import catalog
+    import lexicon
+    import pagecache
+    import patchscrapper
+    return [
+        # newest first straight off the listing index, LIMIT stops the scan after one page
+        ("listing", lambda: db.get_patches(None, 20), ("SCAN patches USING COVERING INDEX idx_patches_listing",)),
+        ("listing page", lambda: db.get_patches(100, 20), ()),
+        ("patchnote", lambda: db.get_patch_by_id(1), ()),
+        ("timeline", lambda: db.get_timeline("hero", "haze"), ("TEMP B-TREE",)),
+        ("search", lambda: db.search_changes("cooldown", hero="haze", kind="nerf"), ("VIRTUAL TABLE", "TEMP B-TREE")),
+        ("stat changes", lambda: db.get_stat_changes("cooldown", "nerf", 10, "2024-01-01T00:00:00"), ("TEMP B-TREE",)),
+        ("known links", lambda: patchscrapper.unseen_links(["a", "b"]), ()),
+        ("generation", lambda: pagecache.current_generation(db.get_connection()), ()),
+        ("catalog items", lambda: catalog.stored_rows("items", catalog.ITEM_COLUMNS, ["a", "b"]), ()),
+        ("catalog heroes", lambda: catalog.stored_rows("characters", catalog.CHARACTER_COLUMNS, ["a", "b"]), ()),
+        ("lexicon", lambda: lexicon.load_rows(db.get_connection()), ("SCAN",)),
+    ]
+
+
+def check_query_plans():
+    # -> [(name, plan step)] for every full scan / temp sort a hot query isn't allowed to do
+    conn = get_connection()
+    problems = []
+    for name, call, allowed in hot_queries():
+        statements = []
+        # the trace gets the sql with its parameters inlined, which plans like the bound statement
+        conn.set_trace_callback(statements.append)
+        try:
+            call()
+        finally:
+            conn.set_trace_callback(None)
+        for sql in statements:
+            # nested statements come back as "-- ...", fts5 reading its shadow tables names 'main'.'...'
+            if not sql.lstrip().upper().startswith("SELECT") or "'main'." in sql:
+                continue
+            for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}"):
+                detail = row[3]
+                # "SCAN x USING COVERING INDEX" still reads the whole index, only SEARCH steps are seeks
+                if (detail.startswith("SCAN") or "TEMP B-TREE" in detail) and not any(step in detail for step in allowed):
+                    problems.append((name, detail))
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="upgrade patch.db to the current schema")
+    parser.add_argument("--check", action="store_true", help="fail if a hot query is not index-backed")
+    args = parser.parse_args()
+
+    migrate()
+    print(f"[migrate] schema version {get_connection().execute('PRAGMA user_version').fetchone()[0]}")
+    if args.check:
+        problems = check_query_plans()
+        for name, detail in problems:
+            print(f"[check_query_plans] {name}: {detail}")
+        print(f"[check_query_plans] {len(hot_queries())} queries, {len(problems)} problems")
+        raise SystemExit(1 if problems else 0)
@@ -1,118 +1,44 @@
 # get data -> categorize -> sort
-import json
+import argparse
+import hashlib
 import os
-import sqlite3
 import re
 import time
+from concurrent.futures import ProcessPoolExecutor
 from pprint import pprint
 import requests
+from pagecache import bump_generation
+from db import get_connection, transaction, decode_text, encode_structure
+from lexicon import get_lexicon
+from notesparser import tokenize, HEADER, VIDEO, IMAGE
 
-# get data ############################################################################################################
+# bump whenever the categorizing / sorting rules change, so stored notes get recategorized
+CATEGORIZER_VERSION = "3"
 
-characters = []
-items = {
-    "Weapon": [],
-    "Spirit": [],
-    "Vitality": []
-}
 
-final_structure = {
-    "[ Heroes ]": {},
-    "[ Items ]": {"Weapon": {}, "Spirit": {}, "Vitality": {}},
-    "[ Gallery ]": [],
-    "[ Hidden ]": []
-}
+def filter_version(lexicon):
+    return f"{CATEGORIZER_VERSION}:{lexicon.version}"
 
-with sqlite3.connect("patch.db") as conn:
-    cursor = conn.cursor()
 
-    # get characters
-    cursor.execute("SELECT name FROM characters")
-    characters.extend([hero_name for (hero_name,) in cursor.fetchall()])
-    for hero in characters:
-        final_structure["[ Heroes ]"][hero] = {"buff": [], "nerf": [], "other": []}
-
-    # get items
-    cursor.execute("SELECT name, category FROM items")
-    for item_name, category in cursor.fetchall():
-        if category not in items:
-            items[category] = []
-        items[category].append(item_name)
-    for category, item_list in items.items():
-        for item in item_list:
-            final_structure["[ Items ]"][category][item] = {"buff": [], "nerf": [], "other": []}
-
-    # get abilites
-    cursor.execute(""" SELECT name, ability1, ability2, ability3, ability4 FROM characters """)
-    char_abilities = {
-        hero_name: [ability1, ability2, ability3, ability4]
-        for hero_name, ability1, ability2, ability3, ability4 in cursor.fetchall()
-    }
+def content_hash(content):
+    return hashlib.sha1(content.encode()).hexdigest()
 
 
 # categorize ##########################################################################################################
 
-def categorize(line, characters, items, final_structure, force_category=None):
-
-    def item_or_hero_flag(line, characters, char_abilities, items):
-        ignore_words = ["long range", "hero labs"]
-        mistyped_dict = {"knockdown": {"Knock Down"}}
-        line_lower = line.lower()
-
-        # handle mistyped items
-        for correct, mistyped_list in mistyped_dict.items():
-            for mistyped in mistyped_list:
-                if mistyped.lower() in line_lower:
-                    line_lower = line_lower.replace(mistyped.lower(), correct)
-
-
-        # check for "item:" format first
-        for category, item_list in items.items():
-            for item in item_list:
-                item_lower = item.lower()
-                if f"{item_lower}:" in line_lower:
-                    return "item", category, item 
-
-        # check for "hero:" format second
-        for hero in characters:
-            # handle exceptions (example:you are perfection, Haze)
-            if f'{hero}"' in line.lower() or f'"{hero}' in line.lower():
-                return None
-            if f"{hero}:" in line_lower:
-                return "hero", hero
-
-        # check for general item mentions
-        for category, item_list in items.items():
-            for item in item_list:
-                item_lower = item.lower()
-                if item_lower in line_lower and not any(ignore_word in line_lower for ignore_word in ignore_words):
-                    return "item", category, item
-
-        # check for general hero mentions
-        for hero in characters:
-            if hero in line_lower and not any(word in line_lower for word in ignore_words):
-                return "hero", hero
-
-        # check for hero abilities at the end
-        for hero, abilities in char_abilities.items():
-            for ability in abilities:
-                if ability is None:
-                    continue
-                if ability.lower() in line_lower:
-                    return "hero", hero
-
-        return None
+def categorize(line, lexicon, final_structure, force_category=None):
 
     # buff or nerf checker
     def buff_flag(line):
         buff_words = ["increased", "improved", "now grants", "now has"]
         nerf_words = ["reduced", "no longer grants"]
-        other_words = ["vfx", "sfx", "sound", "animation", "Paradoxical Swap time", "visual"]
+        other_words = ["vfx", "sfx", "sound", "animation", "paradoxical swap time", "visual"]
+        line_lower = line.lower()
 
-        if any(phrase.lower() in line.lower() for phrase in other_words):
+        if any(phrase in line_lower for phrase in other_words):
             return "other"
 
-        if "cooldown" in line.lower() or "cd" in line.lower():
+        if "cooldown" in line_lower or "cd" in line_lower:
             time_values = re.findall(r"-?\d+\.?\d*s", line)
             if time_values:
                 time_values = [float(val.replace('s', '')) for val in time_values]
@@ -128,15 +54,15 @@ def categorize(line, characters, items, final_structure, force_category=None):
             else:
                 return "other"
 
-        elif any(word in line.lower() for word in buff_words):
+        elif any(word in line_lower for word in buff_words):
             return "buff"
-        elif any(word in line.lower() for word in nerf_words):
+        elif any(word in line_lower for word in nerf_words):
             return "nerf"
         else:
             return "other"
 
     # main categorizing logic
-    result = item_or_hero_flag(line, characters, char_abilities, items)
+    result = lexicon.matcher.match(line)
     if result:
         if result[0] == "item":
             category, item_name = result[1], result[2]
@@ -182,91 +108,256 @@ def clear_empty_data(final_structure):
     final_structure["[ Heroes ]"] = {hero: value for hero, value in final_structure["[ Heroes ]"].items() if any(value.values())}
 
 
+# summary ##############################################################################################################
+
+# precomputed per-patch counts, so the homepage never has to load content_filtered
+SUMMARY_COLUMNS = ("hero_count", "weapon_count", "spirit_count", "vitality_count", "gallery_count", "hidden_count")
+
+
+def summarize(final_structure):
+    items = final_structure.get("[ Items ]", {})
+    return (
+        len(final_structure.get("[ Heroes ]", {})),
+        len(items.get("Weapon", {})),
+        len(items.get("Spirit", {})),
+        len(items.get("Vitality", {})),
+        len(final_structure.get("[ Gallery ]", [])),
+        len(final_structure.get("[ Hidden ]", [])),
+    )
+
+
+def save_summary(cursor, id, final_structure):
+    assignments = ", ".join(f"{column} = ?" for column in SUMMARY_COLUMNS)
+    cursor.execute(f"UPDATE patches SET {assignments} WHERE id = ?", (*summarize(final_structure), id))
+
+
+# changes ##############################################################################################################
+
+# "X reduced from 45s to 35s", multi-level values ("200/230/260%") keep their first level
+NUMBER = r"[+-]?~?\d*\.?\d+(?:/[+-]?\d*\.?\d+)*"
+UNIT = r"(?:%|m/s|ms|s|m|x)(?![\w/])"
+FROM_TO = re.compile(rf"^(?P<stat>.*?)\s*\bfrom\s+(?P<old>{NUMBER})\s*(?P<old_unit>{UNIT})?.*?\bto\s+(?P<new>{NUMBER})\s*(?P<unit>{UNIT})?")
+# "X increased by 15%"
+BY_PERCENT = re.compile(rf"^(?P<stat>.*?)\s*\b(?P<verb>increased|increases|reduced|reduces|decreased)\s+by\s+(?P<delta>{NUMBER})%")
+
+# first keyword found in the stat text decides the stat, more specific ones first
+STAT_KEYWORDS = [
+    ("cooldown", "cooldown"), (" cd", "cooldown"), ("duration", "duration"), ("fire rate", "fire rate"),
+    ("spirit power", "spirit power"), ("lifesteal", "lifesteal"), ("resist", "resist"), ("dps", "damage"),
+    ("damage", "damage"), ("radius", "radius"), ("range", "range"), ("regen", "regen"), ("health", "health"),
+    ("ammo", "ammo"), ("speed", "speed"), ("slow", "slow"), ("cost", "cost"), ("bounty", "bounty"),
+    ("charge", "charges"), ("heal", "healing"), ("shield", "shield"),
+]
+
+
+def first_number(value):
+    return float(value.split("/")[0].replace("~", ""))
+
+
+def classify_stat(text):
+    text = f" {text.lower()}"
+    for keyword, stat in STAT_KEYWORDS:
+        if keyword in text:
+            return stat
+    return "other"
+
+
+def extract_values(line):
+    # (stat, old value, new value, unit, % delta) of a numeric change, all None if the line has none
+    text = line.split(": ", 1)[1] if ": " in line else line
+
+    match = FROM_TO.search(text)
+    if match:
+        old, new = first_number(match["old"]), first_number(match["new"])
+        unit = match["unit"] or match["old_unit"]
+        # "from 10% Max HP to 300 HP" / "from +100 damage to -30s Cooldown" compare different things, no delta
+        same_unit = match["old_unit"] == match["unit"]
+        pct_delta = round((new - old) / abs(old) * 100, 2) if old and same_unit else None
+        return classify_stat(match["stat"] or text), old, new, unit, pct_delta
+
+    match = BY_PERCENT.search(text)
+    if match:
+        delta = first_number(match["delta"])
+        if match["verb"] not in ("increased", "increases"):
+            delta = -delta
+        return classify_stat(match["stat"] or text), None, None, "%", delta
+
+    return None, None, None, None, None
+
+
+# one row per categorized line, so per-hero / per-item history is an index lookup instead of parsing every blob
+def structure_to_changes(id, final_structure):
+    rows = []
+    for hero, kinds in final_structure["[ Heroes ]"].items():
+        for kind, lines in kinds.items():
+            rows.extend((id, "hero", hero, None, kind, line, *extract_values(line)) for line in lines)
+    for category, item_dict in final_structure["[ Items ]"].items():
+        for item, kinds in item_dict.items():
+            for kind, lines in kinds.items():
+                rows.extend((id, "item", item, category, kind, line, *extract_values(line)) for line in lines)
+    for section, lines in final_structure.items():
+        if section not in ["[ Heroes ]", "[ Items ]", "[ Gallery ]", "[ Hidden ]"]:
+            rows.extend((id, "section", section, None, "other", line, *extract_values(line)) for line in lines)
+    return rows
+
+
+def save_changes(cursor, id, final_structure):
+    cursor.execute("DELETE FROM changes WHERE patch_id = ?", (id,))
+    cursor.executemany("""INSERT INTO changes (patch_id, entity_type, entity, category, kind, line,
+                                               stat, old_value, new_value, unit, pct_delta)
+                          VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", structure_to_changes(id, final_structure))
+
+
 # final ################################################################################################################
 
-def notes_to_json(id, conn):
-    cursor = conn.cursor()
+def categorize_content(content, lexicon):
+    final_structure_copy = lexicon.empty_structure()
+
+    # categorize (exceptions for image and nested note)
+    last_category = None
+    for event in tokenize(content):
+        if event[0] == HEADER:
+            last_category = event[1]
+        elif event[0] == VIDEO:
+            categorize(event[1], lexicon, final_structure_copy, force_category="[ Hidden ]")
+        elif event[0] == IMAGE:
+            categorize(event[1], lexicon, final_structure_copy, force_category="[ Gallery ]")
+        else:
+            last_category_temp = last_category if last_category is not None else "[ General Changes ]"
+            categorize(event[1], lexicon, final_structure_copy, force_category=last_category_temp)
 
-    cursor.execute("SELECT content FROM patches WHERE id = ?", (id,))
-    content = cursor.fetchone()
+    # sort and clear
+    sorting(final_structure_copy)
+    clear_empty_data(final_structure_copy)
+    return final_structure_copy
 
-    if content:
-        final_structure_copy = {
-            "[ Heroes ]": {hero: {"buff": [], "nerf": [], "other": []} for hero in characters},
-            "[ Items ]": {category: {item: {"buff": [], "nerf": [], "other": []} for item in item_list} for
-                      category, item_list in items.items()},
-            "[ Gallery ]": [], "[ Hidden ]": []
-        }
-
-        # categorize (exceptions for image and nested note)
-        last_line = None
-        last_category = None
-        temporary_list: []
-
-        for line in content[0].splitlines():
-            stripped_line = re.sub(r'<.*?>', '', line).strip().replace("- ", "")
-
-            if stripped_line.endswith(".mp4"):
-                categorize(stripped_line, characters, items, final_structure_copy, force_category="[ Hidden ]")
-                continue
 
-            # check if its the category
-            elif stripped_line.startswith("[") and stripped_line.endswith("]"):
-                last_category = stripped_line
-                continue
+def save_filtered(cursor, id, final_structure, content_hash, filter_version):
+    cursor.execute("UPDATE patches SET content_filtered = ?, content_hash = ?, filter_version = ? WHERE id = ?",
+                   (encode_structure(final_structure), content_hash, filter_version, id))
+    save_summary(cursor, id, final_structure)
+    save_changes(cursor, id, final_structure)
 
-            elif '<div style="margin-left: 20px">' in line:
-                if not last_line.endswith(":"):
-                    last_line = last_line + ": "
-                last_category_temp = last_category if last_category is not None else "[ General Changes ]"
-                for chunk in line.split('<div style="margin-left: 20px">'):
-                    if not chunk.strip():
-                        continue
 
-                    chunk = re.sub(r'<.*?>', '', chunk).strip()
-                    chunk = chunk.replace("- ", f"{last_line} ")
+def notes_to_json(id, conn, commit=True):
+    cursor = conn.cursor()
 
-                    categorize(chunk, characters, items, final_structure_copy, force_category=last_category_temp)
-                continue
+    cursor.execute("SELECT content FROM patches WHERE id = ?", (id,))
+    content = cursor.fetchone()
 
-            # check if line has any image src
-            elif 'src' in line:
-                src_pattern = r'src="([^"]+)"'
-                src_match = re.search(src_pattern, line)
-                if src_match:
-                    line = src_match.group(1)
-                    categorize(line, characters, items, final_structure_copy, force_category="[ Gallery ]")
-                    continue
-
-            # if line ends with ":", remove it
-            elif stripped_line.endswith(":"):
-                stripped_line = stripped_line[:-1]
-
-            # ignore empty lines
-            elif stripped_line == "":
+    if content:
+        lexicon = get_lexicon(conn)
+        content = decode_text(content[0])
+        final_structure = categorize_content(content, lexicon)
+        save_filtered(cursor, id, final_structure, content_hash(content), filter_version(lexicon))
+        bump_generation(conn)
+        if commit:
+            conn.commit()
+
+
+# reprocess ############################################################################################################
+
+_worker_lexicon = None
+
+
+def _init_worker(lexicon):
+    global _worker_lexicon
+    _worker_lexicon = lexicon
+
+
+def _categorize_task(row):
+    id, content = row
+    start = time.perf_counter()
+    try:
+        content = decode_text(content)
+        final_structure = categorize_content(content, _worker_lexicon)
+        return id, final_structure, content_hash(content), time.perf_counter() - start, None
+    except Exception as e:
+        return id, None, None, time.perf_counter() - start, f"{type(e).__name__}: {e}"
+
+
+def stale_patch_ids(conn, lexicon, verify_content=False):
+    # a patch is stale when it was categorized by other rules / another lexicon, or its content changed since
+    version = filter_version(lexicon)
+    if not verify_content:
+        return [id for (id,) in conn.execute(
+            """SELECT id FROM patches WHERE content IS NOT NULL
+               AND (content_filtered IS NULL OR content_hash IS NULL OR filter_version IS NOT ?)
+               ORDER BY id""", (version,))]
+
+    # re-hashing every content blob is a few ms for the whole history, fine for the cli, not for every poll
+    return [id for id, content, stored_hash, stored_version, filtered in conn.execute(
+                "SELECT id, content, content_hash, filter_version, content_filtered FROM patches "
+                "WHERE content IS NOT NULL ORDER BY id")
+            if filtered is None or stored_version != version or stored_hash != content_hash(decode_text(content))]
+
+
+def reprocess(ids=None, workers=None, batch_size=20, force=False):
+    # categorization fans out over a process pool, the parent writes results back in batched transactions
+    conn = get_connection()
+    lexicon = get_lexicon(conn)
+    version = filter_version(lexicon)
+
+    if ids is None and force:
+        ids = [id for (id,) in conn.execute("SELECT id FROM patches ORDER BY id")]
+    elif ids is None:
+        ids = stale_patch_ids(conn, lexicon, verify_content=True)
+        if not ids:
+            print(f"[reprocess] nothing to do, every patch is at {version}")
+            return 0, []
+    placeholders = ", ".join("?" for _ in ids)
+    rows = [tuple(row) for row in conn.execute(
+        f"SELECT id, content FROM patches WHERE id IN ({placeholders}) AND content IS NOT NULL ORDER BY id", ids)]
+
+    start = time.perf_counter()
+    processed, errors, batch = 0, [], []
+
+    def flush():
+        with transaction() as write_conn:
+            cursor = write_conn.cursor()
+            for id, final_structure, digest in batch:
+                save_filtered(cursor, id, final_structure, digest, version)
+            bump_generation(write_conn)
+        batch.clear()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(lexicon,)) as pool:
+        for id, final_structure, digest, elapsed, error in pool.map(_categorize_task, rows, chunksize=4):
+            if error:
+                errors.append((id, error))
+                print(f"[reprocess] error processing patch ID: {id} ({elapsed * 1000:.1f} ms). Error: {error}")
                 continue
+            print(f"[reprocess] processed patch ID: {id} ({elapsed * 1000:.1f} ms)")
+            batch.append((id, final_structure, digest))
+            processed += 1
+            if len(batch) >= batch_size:
+                flush()
+    if batch:
+        flush()
+
+    print(f"[reprocess] {processed} patches in {time.perf_counter() - start:.2f}s, {len(errors)} errors, "
+          f"version {version}")
+    return processed, errors
 
-            # categorize the line
-            last_category_temp = last_category if last_category is not None else "[ General Changes ]"
-            categorize(stripped_line, characters, items, final_structure_copy, force_category=last_category_temp)
-            last_line = re.sub(r'<.*?>', '', line).strip().replace("- ", "")
 
-        # sort clear and commit
-        sorting(final_structure_copy)
-        clear_empty_data(final_structure_copy)
-        content_filtered = json.dumps(final_structure_copy)
-        cursor.execute("UPDATE patches SET content_filtered = ? WHERE id = ?", (content_filtered, id))
-        conn.commit()
+def refresh_stale():
+    # cheap stamp check for startup / the updater, only recategorizes what the current rules would change
+    conn = get_connection()
+    ids = stale_patch_ids(conn, get_lexicon(conn))
+    if ids:
+        print(f"[refresh_stale] {len(ids)} patches categorized by older rules or lexicon")
+        reprocess(ids)
+    return len(ids)
 
 
 ########################################################################################################################
 if __name__ == "__main__":
-    start_id = 1
-    end_id = 100
-
-    for current_id in range(start_id, end_id + 1):
-        try:
-            notes_to_json(current_id, conn)
-            print(f"processed patch ID: {current_id}")
-        except Exception as e:
-            print(f"error processing patch ID: {current_id}. Error: {e}")
+    parser = argparse.ArgumentParser(description="recategorize stored patch notes")
+    parser.add_argument("ids", nargs="*", type=int, help="patch ids to reprocess (default: stale ones)")
+    parser.add_argument("--all", action="store_true", help="reprocess every patch, stale or not")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--batch-size", type=int, default=20, help="patches written per transaction")
+    args = parser.parse_args()
+
+    from migrations import migrate
+    migrate()
+    reprocess(args.ids or None, workers=args.workers, batch_size=args.batch_size, force=args.all)
@@ -0,0 +1,101 @@
+# single-pass tokenizer for stored bbWrapper html, feeds newfiltering.categorize_content
+from html.parser import HTMLParser
+
+NESTED_STYLE = "margin-left: 20px"
+
+# events
+HEADER = "header"    # ("header", "[ General Changes ]")
+BULLET = "bullet"    # ("bullet", text)
+NESTED = "nested"    # ("nested", text prefixed with its parent, parent)
+IMAGE = "image"      # ("image", src)
+VIDEO = "video"      # ("video", "View attachment clip.mp4")
+
+
+class PatchNoteTokenizer(HTMLParser):
+    # the forum puts one note per source line, so events are decided per line,
+    # with nested <div style="margin-left: 20px"> notes split into chunks under their parent line
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.events = []
+        self.parent = None
+        self._start_line()
+
+    def _start_line(self):
+        # [text, has raw content (text or tags)] per chunk, a new chunk starts at every nested div
+        self.chunks = [["", False]]
+        self.nested = False
+        self.src = None
+        self.mentions_src = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "div" and ("style", NESTED_STYLE) in attrs:
+            self.nested = True
+            self.chunks.append(["", False])
+        else:
+            self.chunks[-1][1] = True
+
+        if attrs and "src" in self.get_starttag_text():
+            self.mentions_src = True
+            for name, value in attrs:
+                if name.endswith("src") and value and self.src is None:
+                    self.src = value
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        self.chunks[-1][1] = True
+
+    def handle_data(self, data):
+        for part in data.splitlines(keepends=True):
+            text = part.splitlines()[0]
+            self.chunks[-1][0] += text
+            if text.strip():
+                self.chunks[-1][1] = True
+            if "src" in text:
+                self.mentions_src = True
+            if len(text) != len(part):
+                self._end_line()
+
+    def close(self):
+        super().close()
+        self._end_line()
+
+    def _end_line(self):
+        stripped = "".join(text for text, _ in self.chunks).strip().replace("- ", "")
+
+        if stripped.endswith(".mp4"):
+            self.events.append((VIDEO, stripped))
+
+        elif stripped.startswith("[") and stripped.endswith("]"):
+            self.events.append((HEADER, stripped))
+
+        elif self.nested:
+            # nested notes read as "<parent line>: <note>"
+            parent = self.parent or ""
+            if not parent.endswith(":"):
+                parent = parent + ": "
+            self.parent = parent
+            for text, has_content in self.chunks:
+                if has_content:
+                    self.events.append((NESTED, text.strip().replace("- ", f"{parent} "), parent))
+
+        elif self.src:
+            self.events.append((IMAGE, self.src))
+
+        elif stripped.endswith(":") and not self.mentions_src:
+            self.events.append((BULLET, stripped[:-1]))
+            self.parent = stripped
+
+        elif stripped or self.mentions_src:
+            self.events.append((BULLET, stripped))
+            self.parent = stripped
+
+        self._start_line()
+
+
+def tokenize(content):
+    tokenizer = PatchNoteTokenizer()
+    tokenizer.feed(content)
+    tokenizer.close()
+    return tokenizer.events
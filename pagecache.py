@@ -0,0 +1,62 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+
+# every write that changes rendered pages bumps the "generation" row in meta,
+# so all web workers notice new data even when ingestion runs in another process
+def bump_generation(conn):
+    # runs inside the caller's transaction, the new generation is visible once it commits
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('generation', ?)", (f"{time.time():.6f}",))
+    page_cache.clear()
+
+
+def current_generation(conn):
+    row = conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+    return row[0] if row else "0"
+
+
+def last_modified(generation):
+    return datetime.fromtimestamp(int(float(generation)), timezone.utc)
+
+
+def page_etag(key, generation):
+    return hashlib.sha1(f"{generation}:{key}".encode()).hexdigest()
+
+
+# rendered html, keyed by route + patch id, evicted least recently used first
+class PageCache:
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, generation):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] != generation:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, generation, body):
+        with self._lock:
+            self._entries[key] = (generation, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+page_cache = PageCache()
@@ -0,0 +1,90 @@
+# times the scraper parsers over recorded pages (FETCH_MODE=record, see fetcher.py) and checks that
+# strained / lxml parsing extracts exactly what a full html.parser tree does
+#   python parsebench.py [--repeat 3] [--cache-dir .fetchcache]
+import argparse
+import contextlib
+import io
+import time
+
+from fetcher import ResponseStore
+from parsing import HAS_LXML, THREAD_PAGE, INDEX_PAGE, HERO_PAGE, ITEM_PAGE, make_soup
+from patchscrapper import parse_patch, parse_index
+
+
+def extract_hero(text, only, parser):
+    return [str(tbody) for tbody in make_soup(text, only, parser).find_all('tbody')]
+
+
+def extract_item(text, only, parser):
+    return [str(table) for table in make_soup(text, only, parser).find_all("table", class_="navbox")[:3]]
+
+
+# page kind -> (url test, extract(text, url, only, parser), strainer)
+PAGE_KINDS = {
+    "thread": (lambda url: "/threads/" in url, lambda text, url, only, parser: parse_patch(text, url, only, parser),
+               THREAD_PAGE),
+    "index": (lambda url: "/forums/" in url, lambda text, url, only, parser: parse_index(text, url, only, parser),
+              INDEX_PAGE),
+    "hero": (lambda url: url.endswith("/Hero"), lambda text, url, only, parser: extract_hero(text, only, parser),
+             HERO_PAGE),
+    "item": (lambda url: url.endswith("/Item"), lambda text, url, only, parser: extract_item(text, only, parser),
+             ITEM_PAGE),
+}
+
+
+def load_pages(store):
+    pages = {kind: [] for kind in PAGE_KINDS}
+    for url in store.urls():
+        for kind, (matches, _, _) in PAGE_KINDS.items():
+            if matches(url):
+                response = store.load(url)
+                if response is not None and response.status_code == 200:
+                    pages[kind].append((url, response.text))
+                break
+    return pages
+
+
+def run(extract, pages, only, parser, repeat):
+    # best of repeat, parsers print found links so stdout is swallowed
+    best, results = None, None
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            results = [extract(text, url, only, parser) for url, text in pages]
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+    return best, results
+
+
+def bench(cache_dir, repeat):
+    pages = load_pages(ResponseStore(cache_dir))
+    parsers = ["html.parser"] + (["lxml"] if HAS_LXML else [])
+    ok = True
+
+    for kind, (_, extract, strainer) in PAGE_KINDS.items():
+        if not pages[kind]:
+            continue
+        baseline, expected = run(extract, pages[kind], None, "html.parser", repeat)
+        print(f"[parsebench] {kind}: {len(pages[kind])} pages, full html.parser {baseline * 1000:.1f} ms")
+
+        for parser in parsers:
+            for only, label in ((None, "full"), (strainer, "strained")):
+                if only is None and parser == "html.parser":
+                    continue
+                elapsed, results = run(extract, pages[kind], only, parser, repeat)
+                mismatches = sum(result != want for result, want in zip(results, expected))
+                ok = ok and not mismatches
+                print(f"[parsebench] {kind}: {label} {parser} {elapsed * 1000:.1f} ms "
+                      f"({baseline / elapsed:.1f}x), {mismatches} mismatching pages")
+
+    if not HAS_LXML:
+        print("[parsebench] lxml not installed, only html.parser measured")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark scraper html parsing over recorded pages")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--cache-dir", default=None, help="recording to read (default: FETCH_CACHE_DIR)")
+    args = parser.parse_args()
+    raise SystemExit(0 if bench(args.cache_dir or ResponseStore().root, args.repeat) else 1)
@@ -0,0 +1,37 @@
+# BeautifulSoup setup shared by the scrapers: each page type only builds the subtrees its parser reads,
+# and HTML_PARSER=lxml switches to the faster backend when lxml is installed (html.parser otherwise)
+import os
+import re
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+try:
+    import lxml  # noqa: F401
+    HAS_LXML = True
+except ImportError:
+    HAS_LXML = False
+
+PARSER = os.environ.get("HTML_PARSER", "html.parser")
+if PARSER == "lxml" and not HAS_LXML:
+    print("[parsing] HTML_PARSER=lxml but lxml is not installed, using html.parser")
+    PARSER = "html.parser"
+
+
+def has_class(*names):
+    # strainers see the raw class attribute ("structItem structItem--thread js-..."), not the split
+    # list find_all matches against, so a plain class_ list would miss every multi-class element
+    return re.compile(r"(?:^|\s)(?:" + "|".join(map(re.escape, names)) + r")(?:\s|$)")
+
+
+# forum thread: post body, title and post time (patchscrapper.parse_patch)
+THREAD_PAGE = SoupStrainer(["article", "h1", "time"], class_=has_class("message-body", "p-title-value", "u-dt"))
+# forum index: thread rows and the next page link (patchscrapper.parse_index)
+INDEX_PAGE = SoupStrainer(["div", "a"], class_=has_class("structItem--thread", "pageNav-jump--next"))
+# wiki hero page: ability tables and hero cards (heroscrapper)
+HERO_PAGE = SoupStrainer("tbody")
+# wiki item page: one navbox table per category (itemscrapper)
+ITEM_PAGE = SoupStrainer("table", class_=has_class("navbox"))
+
+
+def make_soup(text, only=None, parser=None):
+    return BeautifulSoup(text, parser or PARSER, parse_only=only)
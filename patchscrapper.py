@@ -1,45 +1,43 @@
-import requests
-from bs4 import BeautifulSoup
-import sqlite3
+import argparse
 import html
+import time
+from urllib.parse import urljoin
+from fetcher import Fetcher, get_fetcher, WORKERS
+from parsing import make_soup, THREAD_PAGE, INDEX_PAGE
 from newfiltering import notes_to_json
-
-database = "patch.db"
-
-def init_db():
-    conn = sqlite3.connect(database)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS patches (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    title TEXT,
-                    content TEXT,
-                    content_filtered TEXT,
-                    link TEXT,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    date TEXT
-                 )''')
-    conn.commit()
-    conn.close()
-
-init_db()
-
+from migrations import migrate
+from db import get_connection, transaction, encode_text
 
 def insert_patch(title, content, link, timestamp, date):
-    with sqlite3.connect(database) as conn:
+    with transaction() as conn:
         c = conn.cursor()
         c.execute("INSERT INTO patches (title, content, link, timestamp, date) VALUES (?, ?, ?, ?, ?)",
-                  (title, content, link, timestamp, date))
+                  (title, encode_text(content), link, timestamp, date))
         last_id = c.lastrowid
         notes_to_json(last_id, conn)
 
 
-def patch_content(link):
-    response = requests.get(link)
-    if response.status_code != 200:
-        print(f"[patch_content] Failed to fetch the patch page: {link}")
-        return None, None
+def insert_patches(patches_data):
+    # oldest first, all or nothing, so ids keep following release order
+    with transaction() as conn:
+        c = conn.cursor()
+        for title, content, link, timestamp, date in patches_data:
+            c.execute("INSERT INTO patches (title, content, link, timestamp, date) VALUES (?, ?, ?, ?, ?)",
+                      (title, encode_text(content), link, timestamp, date))
+            notes_to_json(c.lastrowid, conn, commit=False)
+    return len(patches_data)
+
 
-    soup = BeautifulSoup(response.text, 'html.parser')
+def unseen_links(links):
+    # links not stored yet, in their original order, one idx_patches_link lookup each
+    placeholders = ", ".join("?" for _ in links)
+    known = {link for (link,) in get_connection().execute(
+        f"SELECT link FROM patches WHERE link IN ({placeholders})", links)} if links else set()
+    return [link for link in links if link not in known]
+
+
+def parse_patch(text, link, only=THREAD_PAGE, parser=None):
+    soup = make_soup(text, only, parser)
 
     content_div = soup.find("article", class_="message-body")
     if content_div:
@@ -49,10 +47,10 @@ def patch_content(link):
             content = html.unescape(content)
         else:
             print(f"[patch_content] no bbWrapper found for {link}")
-            return None, None
+            return None, None, None, None
     else:
         print(f"[patch_content] no content_div found for {link}")
-        return None, None
+        return None, None, None, None
 
     title_element = soup.find("h1", class_="p-title-value")
     if title_element:
@@ -60,7 +58,7 @@ def patch_content(link):
         date = title.split()[0]
     else:
         print(f"[patch_content] no title_element found for {link}")
-        return None, None
+        return None, None, None, None
 
     time_element = soup.find("time", class_="u-dt")
     timestamp = None
@@ -71,40 +69,94 @@ def patch_content(link):
 
     return content, timestamp, title, date
 
-def scrapper(forums="https://forums.playdeadlock.com/forums/changelog.10/"):
-    patches_data = []
+
+def patch_content(link, fetcher=None):
+    response = (fetcher or get_fetcher()).get(link)
+    if response is None or response.status_code != 200:
+        print(f"[patch_content] Failed to fetch the patch page: {link}")
+        return None, None, None, None
+
+    return parse_patch(response.text, link)
+
+
+def parse_index(text, url, only=INDEX_PAGE, parser=None):
+    # thread links (newest first, the pinned first thread skipped) and the next index page, if any;
+    # links are resolved against the page url so a local mirror works too
+    soup = make_soup(text, only, parser)
+    links = []
+
+    threads = soup.find_all("div", class_="structItem--thread")
+
+    for thread in threads[1:]:
+        link_container = thread.find("div", class_="structItem-title")
+        if link_container:
+            link_tag = link_container.find("a", href=True)
+            if link_tag:
+                link = urljoin(url, link_tag['href'])
+                print(f"[patch_link] Found link: {link}")
+                links.append(link)
+
+    next_page = soup.find("a", class_="pageNav-jump--next", href=True)
+    return links, urljoin(url, next_page['href']) if next_page else None
+
+
+def thread_links(forums, fetcher=None, first_page=None, until_known=False):
+    # unseen links over every index page, or with until_known only as far as the first page
+    # that reaches an already stored thread
+    fetcher = fetcher or get_fetcher()
+    links = []
 
     while forums:
-        print(f"[patch_link] Fetching page: {forums}")
-        response = requests.get(forums)
-        if response.status_code != 200:
-            print("[patch_link] Failed to fetch the forum page.")
+        if first_page is not None:
+            text, first_page = first_page, None
+        else:
+            print(f"[patch_link] Fetching page: {forums}")
+            response = fetcher.get(forums)
+            if response is None or response.status_code != 200:
+                print("[patch_link] Failed to fetch the forum page.")
+                break
+            text = response.text
+
+        page_links, forums = parse_index(text, forums)
+        unseen = unseen_links(page_links)
+        links.extend(unseen)
+        if until_known and len(unseen) < len(page_links):
             break
 
-        soup = BeautifulSoup(response.text, 'html.parser')
+    return links
+
 
-        threads = soup.find_all("div", class_="structItem--thread")
+def fetch_patches(links, fetcher=None):
+    # thread pages in parallel, results keep the order of links (newest first); only the oldest run up to
+    # the first failed thread is returned, so a retry never inserts an older patch after a newer one
+    fetcher = fetcher or get_fetcher()
+    patches_data = []
+    results = fetcher.map(lambda link: patch_content(link, fetcher), links)
+    for link, (content, timestamp, title, date) in reversed(list(zip(links, results))):
+        if not (content and timestamp):
+            print(f"[fetch_patches] {link} failed, it and {len(links) - len(patches_data) - 1} newer threads are left for the retry")
+            break
+        patches_data.append((title, content, link, timestamp, date))
+    return list(reversed(patches_data))
 
-        for thread in threads[1:]:
-            link_container = thread.find("div", class_="structItem-title")
-            if link_container:
-                link_tag = link_container.find("a", href=True)
-                if link_tag:
-                    link = "https://forums.playdeadlock.com" + link_tag['href']
-                    print(f"[patch_link] Found link: {link}")
 
-                    content, timestamp, title, date = patch_content(link)
-                    if content and timestamp:
-                        patches_data.append((title, content, link, timestamp, date))
+def scrapper(forums="https://forums.playdeadlock.com/forums/changelog.10/", fetcher=None):
+    start = time.perf_counter()
+    fetcher = fetcher or get_fetcher()
 
-        next_page = soup.find("a", class_="pageNav-jump--next", href=True)
-        if next_page:
-            forums = "https://forums.playdeadlock.com" + next_page['href']
-        else:
-            forums = None
+    links = thread_links(forums, fetcher)
+    patches_data = fetch_patches(links, fetcher)
+    inserted = insert_patches(list(reversed(patches_data)))
 
-    for title, content, link, timestamp, date in reversed(patches_data):
-        insert_patch(title, content, link, timestamp, date)
+    print(f"[scrapper] {inserted} new patches from {len(links)} unseen threads in {time.perf_counter() - start:.2f}s")
+    return inserted
 
 if __name__ == "__main__":
-    scrapper()
+    parser = argparse.ArgumentParser(description="backfill every changelog thread missing from the database")
+    parser.add_argument("forums", nargs="?", default="https://forums.playdeadlock.com/forums/changelog.10/",
+                        help="first changelog index page")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="concurrent thread page fetches")
+    parser.add_argument("--rate", type=float, default=10, help="max requests per second per host (0 = unlimited)")
+    args = parser.parse_args()
+    migrate()
+    scrapper(args.forums, Fetcher(workers=args.workers, per_second=args.rate))
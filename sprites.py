@@ -0,0 +1,185 @@
+# sprite atlases for the icon sets: every image in a set is packed into one png (+ webp) sheet, with
+# static/sprites/sprites.json holding the coordinates and sprites.css one class per icon, so a patch page
+# loads its item icons / hero portraits in a couple of requests instead of one per changed entity.
+# Pillow is optional, like for imagevariants: without it sprite() falls back to picture()
+import argparse
+import hashlib
+import json
+import os
+import re
+import time
+
+from markupsafe import Markup, escape
+
+from assetsync import file_sha1
+from fetcher import atomic_write
+from staticbuild import asset_url, build as build_assets
+from imagevariants import picture
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+STATIC_DIR = "static"
+SPRITE_DIR = os.path.join(STATIC_DIR, "sprites")
+MAP = os.path.join(SPRITE_DIR, "sprites.json")
+STYLESHEET = os.path.join(SPRITE_DIR, "sprites.css")
+# sheet name -> icon directory under static/, entities are named by their path in it without the extension
+SHEETS = {"img": "assets/img"}
+SOURCE_TYPES = (".png", ".jpg", ".jpeg")
+MAX_WIDTH = 1024
+# transparent gap so scaled-down icons don't bleed into their neighbours
+PADDING = 2
+
+_map = {"mtime": None, "sheets": {}}
+
+
+def slug(name):
+    return re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-")
+
+
+def pack(sizes):
+    # shelf packing, tallest first: {name: (x, y)}, sheet width, sheet height
+    positions, x, y, shelf, width = {}, 0, 0, 0, 0
+    for name, (w, h) in sorted(sizes.items(), key=lambda item: (-item[1][1], -item[1][0], item[0])):
+        if x and x + w > MAX_WIDTH:
+            x, y, shelf = 0, y + shelf + PADDING, 0
+        positions[name] = (x, y)
+        x += w + PADDING
+        shelf = max(shelf, h)
+        width = max(width, x - PADDING)
+    return positions, width, y + shelf
+
+
+def sources(directory):
+    found = {}
+    for root, _, files in os.walk(os.path.join(STATIC_DIR, directory)):
+        for name in files:
+            if name.lower().endswith(SOURCE_TYPES):
+                path = os.path.join(root, name)
+                found[os.path.splitext(os.path.relpath(path, os.path.join(STATIC_DIR, directory)))[0]
+                      .replace(os.sep, "/")] = path
+    return found
+
+
+def build_sheet(sheet, directory, previous):
+    # -> map entry; the sheet is only drawn again when an icon was added, removed or changed
+    icons = sources(directory)
+    signature = hashlib.sha1(json.dumps(sorted((name, file_sha1(path)) for name, path in icons.items())).encode()).hexdigest()
+    if previous and previous["signature"] == signature and all(
+            os.path.exists(os.path.join(STATIC_DIR, previous[fmt])) for fmt in ("png", "webp")):
+        return previous, False
+
+    images = {}
+    for name, path in icons.items():
+        with Image.open(path) as image:
+            images[name] = image.convert("RGBA")
+    positions, width, height = pack({name: image.size for name, image in images.items()})
+    atlas = Image.new("RGBA", (max(width, 1), max(height, 1)))
+    for name, image in images.items():
+        atlas.paste(image, positions[name])
+
+    os.makedirs(SPRITE_DIR, exist_ok=True)
+    entry = {"signature": signature, "width": atlas.width, "height": atlas.height,
+             "png": f"sprites/{sheet}.png", "webp": f"sprites/{sheet}.webp",
+             "sprites": {name: [*positions[name], *images[name].size] for name in sorted(images)}}
+    atlas.save(os.path.join(STATIC_DIR, entry["png"]), "PNG", optimize=True)
+    atlas.save(os.path.join(STATIC_DIR, entry["webp"]), "WEBP", quality=80, method=4)
+    return entry, True
+
+
+def stylesheet(sheets):
+    # percentages keep every sprite scalable: the element only needs the icon's aspect ratio
+    rules = [".sprite {\n    display: inline-block;\n    vertical-align: middle;\n    background-repeat: no-repeat;\n}"]
+    for sheet, entry in sheets.items():
+        png, webp = f"/static/{entry['png']}", f"/static/{entry['webp']}"
+        rules.append(f".sprite-{sheet} {{\n    background-image: url(\"{png}\");\n"
+                     f"    background-image: image-set(url(\"{webp}\") type(\"image/webp\"), url(\"{png}\") type(\"image/png\"));\n}}")
+        for name, (x, y, w, h) in entry["sprites"].items():
+            left = x / (entry["width"] - w) * 100 if entry["width"] > w else 0
+            top = y / (entry["height"] - h) * 100 if entry["height"] > h else 0
+            rules.append(f".sprite-{sheet}-{slug(name)} {{\n"
+                         f"    background-size: {entry['width'] / w * 100:.4f}% {entry['height'] / h * 100:.4f}%;\n"
+                         f"    background-position: {left:.4f}% {top:.4f}%;\n}}")
+    return "\n\n".join(rules) + "\n"
+
+
+def build():
+    if Image is None:
+        print("[sprites] Pillow is not installed, no sprite sheets")
+        return load_map()
+
+    start = time.perf_counter()
+    previous = load_map()
+    sheets, drawn = {}, []
+    for sheet, directory in SHEETS.items():
+        sheets[sheet], changed = build_sheet(sheet, directory, previous.get(sheet))
+        if changed:
+            drawn.append(sheet)
+        slugs = {}
+        for name in sheets[sheet]["sprites"]:
+            if slug(name) in slugs:
+                print(f"[sprites] {sheet}: '{name}' and '{slugs[slug(name)]}' share a css class")
+            slugs[slug(name)] = name
+
+    # sheets no longer in SHEETS go with their images
+    removed = [sheet for sheet in previous if sheet not in sheets]
+    for sheet in removed:
+        for fmt in ("png", "webp"):
+            try:
+                os.unlink(os.path.join(STATIC_DIR, previous[sheet][fmt]))
+            except FileNotFoundError:
+                pass
+
+    if drawn or removed or not os.path.exists(STYLESHEET):
+        atomic_write(STYLESHEET, stylesheet(sheets).encode("utf-8"))
+        atomic_write(MAP, json.dumps(sheets, indent=1, sort_keys=True).encode())
+    print(f"[sprites] {sum(len(entry['sprites']) for entry in sheets.values())} icons in {len(sheets)} sheets, "
+          f"{len(drawn)} redrawn in {time.perf_counter() - start:.2f}s")
+    return sheets
+
+
+def load_map(path=MAP):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def current_map():
+    try:
+        mtime = os.stat(MAP).st_mtime_ns
+    except OSError:
+        mtime = None
+    if mtime != _map["mtime"]:
+        _map["sheets"], _map["mtime"] = load_map(), mtime
+    return _map["sheets"]
+
+
+def sprite(sheet, name, width, alt=None):
+    # template helper: sprite('img', 'abrams', 88) -> a sized <i> showing that icon from the sheet,
+    # or the single image through picture() when the sheet doesn't have it. not a <span>: style.css styles
+    # every span (and .pic-hero span is the hero name label)
+    entry = current_map().get(sheet)
+    if not entry or name not in entry["sprites"]:
+        return picture(f"{SHEETS[sheet]}/{name}.png", width, alt or "")
+    _, _, w, h = entry["sprites"][name]
+    return Markup(f'<i class="sprite sprite-{sheet} sprite-{sheet}-{slug(name)}" role="img" '
+                  f'aria-label="{escape(alt or name)}" style="width: {width}px; height: {round(h * width / w)}px"></i>')
+
+
+def sprite_stylesheet():
+    # head.html: the sprite css, once there is one
+    if not current_map():
+        return ""
+    return Markup(f'<link href="{escape(asset_url("sprites/sprites.css"))}" rel="stylesheet">')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="pack the icon sets into sprite sheets")
+    parser.parse_args()
+    build()
+    # so asset_url picks the new sheets / stylesheet up
+    build_assets()
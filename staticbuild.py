@@ -0,0 +1,155 @@
+# asset build: copies static/ into static/dist under content-hashed names with a manifest, so templates can
+# link them through asset_url() and browsers can cache them forever. text assets and fonts also get
+# .gz / .br siblings (brotli only when the module is installed) for nginx gzip_static / brotli_static
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import time
+
+from fetcher import atomic_write
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = "static"
+BUILD_DIR = os.path.join(STATIC_DIR, "dist")
+MANIFEST = os.path.join(BUILD_DIR, "manifest.json")
+BUILD_URL = "/static/dist/"
+# precompressed, a variant is only kept when it is at least 10% smaller (woff / woff2 usually aren't)
+COMPRESSIBLE = (".css", ".js", ".svg", ".ico", ".otf", ".ttf", ".woff", ".woff2")
+MIN_SAVING = 0.9
+# replaced hashes stay servable this long, for pages / stylesheets cached before the build that replaced them
+RETAIN = 7 * 24 * 3600
+# quoted /static/... references in css url()
+STATIC_REF = re.compile(r"""(["'(])/static/([^"'()?#]+)""")
+
+_manifest = {"stamp": None, "files": {}, "version": ""}
+
+
+def hashed_name(path, data):
+    root, ext = os.path.splitext(path)
+    return f"{root}.{hashlib.sha1(data).hexdigest()[:10]}{ext}"
+
+
+def rewrite_static(text, files):
+    # unknown paths (a font that isn't checked in) are left as they are
+    return STATIC_REF.sub(lambda m: m.group(1) + (BUILD_URL + files[m.group(2)] if m.group(2) in files
+                                                 else "/static/" + m.group(2)), text)
+
+
+def precompress(path, data):
+    written = 0
+    variants = [(".gz", lambda: gzip.compress(data, 9, mtime=0))]
+    if brotli:
+        variants.append((".br", lambda: brotli.compress(data)))
+    for suffix, compress in variants:
+        if os.path.exists(path + suffix):
+            continue
+        packed = compress()
+        if len(packed) <= len(data) * MIN_SAVING:
+            atomic_write(path + suffix, packed)
+            written += 1
+    return written
+
+
+def load_manifest(path=MANIFEST):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def manifest_version(files):
+    return hashlib.sha1(json.dumps(files, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def build(static_dir=STATIC_DIR, build_dir=BUILD_DIR):
+    # -> manifest {"css/style.css": "css/style.<hash>.css", ...}; hashed names never change content,
+    # so only new files are written, and files replaced more than RETAIN ago are pruned
+    start = time.perf_counter()
+    sources = {}
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = [d for d in dirs if os.path.join(root, d) != build_dir]
+        for name in files:
+            path = os.path.join(root, name)
+            sources[os.path.relpath(path, static_dir).replace(os.sep, "/")] = path
+
+    files, written, compressed = {}, 0, 0
+    # stylesheets point at fonts / images, so they are hashed after their rewritten urls
+    for rel in sorted(sources, key=lambda rel: rel.endswith(".css")):
+        with open(sources[rel], "rb") as f:
+            data = f.read()
+        if rel.endswith(".css"):
+            data = rewrite_static(data.decode("utf-8"), files).encode("utf-8")
+        files[rel] = hashed_name(rel, data)
+        target = os.path.join(build_dir, files[rel])
+        if not os.path.exists(target):
+            atomic_write(target, data)
+            written += 1
+        if rel.endswith(COMPRESSIBLE):
+            compressed += precompress(target, data)
+
+    # retired.json: hashed name -> when a build first stopped listing it
+    retired_path = os.path.join(build_dir, "retired.json")
+    previous, retired = load_manifest(os.path.join(build_dir, "manifest.json")), load_manifest(retired_path)
+    live, now, kept, pruned = set(files.values()), time.time(), set(), 0
+    for root, _, names in os.walk(build_dir):
+        for name in names:
+            rel = os.path.relpath(os.path.join(root, name), build_dir).replace(os.sep, "/")
+            hashed = re.sub(r"\.(gz|br)$", "", rel)
+            if rel in ("manifest.json", "retired.json") or hashed in live:
+                continue
+            retired.setdefault(hashed, now)
+            if now - retired[hashed] > RETAIN:
+                os.unlink(os.path.join(root, name))
+                pruned += 1
+            else:
+                kept.add(hashed)
+    retired = {hashed: at for hashed, at in retired.items() if hashed in kept}
+    atomic_write(retired_path, json.dumps(retired, indent=1, sort_keys=True).encode())
+
+    # the manifest's mtime feeds the pages' Last-Modified, so an unchanged build leaves it alone
+    if files != previous:
+        atomic_write(os.path.join(build_dir, "manifest.json"), json.dumps(files, indent=1, sort_keys=True).encode())
+    print(f"[staticbuild] {len(files)} assets, {written} written, {compressed} precompressed, {pruned} pruned "
+          f"in {time.perf_counter() - start:.2f}s")
+    return files
+
+
+def current_manifest():
+    # atomic_write renames a new file in, so the inode tells apart two builds within the mtime granularity
+    try:
+        stat = os.stat(MANIFEST)
+        stamp = (stat.st_mtime_ns, stat.st_ino)
+    except OSError:
+        stamp = None
+    if stamp != _manifest["stamp"]:
+        files = load_manifest(MANIFEST)
+        _manifest.update(files=files, stamp=stamp, version=manifest_version(files))
+    return _manifest
+
+
+def asset_version():
+    # -> (fingerprint, unix time) of the current manifest; every rendered page embeds its hashed urls,
+    # so page etags / Last-Modified have to move with it
+    manifest = current_manifest()
+    return manifest["version"], manifest["stamp"][0] / 1e9 if manifest["stamp"] else 0
+
+
+def asset_url(path):
+    # template helper: asset_url('css/style.css') -> /static/dist/css/style.<hash>.css,
+    # plain /static/<path> for anything the last build didn't see
+    hashed = current_manifest()["files"].get(path)
+    return BUILD_URL + hashed if hashed else "/static/" + path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="content-hash and precompress static assets into static/dist")
+    parser.parse_args()
+    build()
@@ -0,0 +1,62 @@
+import hashlib
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+import migrations
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    # a migrated patch.db in tmp_path, the thread-local connection points at it for the test
+    monkeypatch.setattr(db, "database", str(tmp_path / "patch.db"))
+    monkeypatch.setattr(migrations, "_migrated", False)
+    db.close_connection()
+    migrations.migrate()
+    yield db.get_connection()
+    db.close_connection()
+
+
+@pytest.fixture
+def site():
+    # local stand-in http server: fill site.pages with {path: html}, urls via site.url(path).
+    # pages carry an etag and answer a matching If-None-Match with a 304, like the forum does
+    pages = {}
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests.append(self.path)
+            body = pages.get(self.path)
+            if body is None:
+                self.send_response(404)
+                self.end_headers()
+                self.wfile.write(b"not found")
+                return
+            etag = f'"{hashlib.sha1(body.encode()).hexdigest()}"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("ETag", etag)
+            self.end_headers()
+            self.wfile.write(body.encode())
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.pages, server.requests = pages, requests
+    server.url = lambda path: f"http://127.0.0.1:{server.server_address[1]}{path}"
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,73 @@
+import fetcher
+from fetcher import Fetcher
+from patchscrapper import scrapper
+from updater import check_for_patch
+
+INDEX = """<html><body>
+<div class="structItem structItem--thread"><div class="structItem-title"><a href="/threads/pinned.1/">Pinned</a></div></div>
+{threads}
+</body></html>"""
+ROW = '<div class="structItem structItem--thread"><div class="structItem-title"><a href="{href}">{title}</a></div></div>'
+THREAD = """<html><body>
+<h1 class="p-title-value">{date} Update</h1>
+<time class="u-dt" datetime="{timestamp}">{date}</time>
+<article class="message-body"><div class="bbWrapper">[ General ]<br>- {line}</div></article>
+</body></html>"""
+
+
+def thread(site, slug, date, timestamp, line):
+    site.pages[f"/threads/{slug}/"] = THREAD.format(date=date, timestamp=timestamp, line=line)
+    return ROW.format(href=f"/threads/{slug}/", title=f"{date} Update")
+
+
+def test_backfill_inserts_threads_oldest_first_once(database, site):
+    # the index lists threads newest first, ids have to follow release order
+    rows = [thread(site, "06-02-2025-update.2", "06-02-2025", "2025-06-02T12:00:00-0700", "Newer change"),
+            thread(site, "05-01-2025-update.1", "05-01-2025", "2025-05-01T12:00:00-0700", "Older change")]
+    site.pages["/forums/changelog.10/"] = INDEX.format(threads="\n".join(rows))
+    fetcher = Fetcher(workers=2, per_second=0, mode="live")
+
+    assert scrapper(site.url("/forums/changelog.10/"), fetcher) == 2
+    patches = database.execute("SELECT id, title, link, timestamp FROM patches ORDER BY id").fetchall()
+    assert [patch["title"] for patch in patches] == ["05-01-2025 Update", "06-02-2025 Update"]
+    assert [patch["link"] for patch in patches] == [site.url("/threads/05-01-2025-update.1/"),
+                                                    site.url("/threads/06-02-2025-update.2/")]
+    assert "/threads/pinned.1/" not in site.requests
+
+    # nothing new on the index: the rerun fetches no thread page and inserts nothing
+    site.requests.clear()
+    assert scrapper(site.url("/forums/changelog.10/"), fetcher) == 0
+    assert site.requests == ["/forums/changelog.10/"]
+    assert database.execute("SELECT COUNT(*) FROM patches").fetchone()[0] == 2
+
+
+def test_failed_thread_holds_back_newer_ones(database, site):
+    rows = [thread(site, "06-02-2025-update.3", "06-02-2025", "2025-06-02T12:00:00-0700", "Newest change"),
+            thread(site, "05-15-2025-update.2", "05-15-2025", "2025-05-15T12:00:00-0700", "Middle change"),
+            thread(site, "05-01-2025-update.1", "05-01-2025", "2025-05-01T12:00:00-0700", "Oldest change")]
+    site.pages["/forums/changelog.10/"] = INDEX.format(threads="\n".join(rows))
+    middle = site.pages.pop("/threads/05-15-2025-update.2/")
+    fetcher = Fetcher(workers=2, per_second=0, retries=0, mode="live")
+
+    # the newest thread fetched fine but would get an id below the middle one once that is retried
+    assert scrapper(site.url("/forums/changelog.10/"), fetcher) == 1
+    site.pages["/threads/05-15-2025-update.2/"] = middle
+    assert scrapper(site.url("/forums/changelog.10/"), fetcher) == 2
+    titles = [row[0] for row in database.execute("SELECT title FROM patches ORDER BY id")]
+    assert titles == ["05-01-2025 Update", "05-15-2025 Update", "06-02-2025 Update"]
+
+
+def test_failed_poll_is_retried_while_the_index_is_unchanged(database, site, monkeypatch):
+    # the index answers the next poll with a 304, the failed thread still has to be fetched again
+    rows = [thread(site, "05-15-2025-update.2", "05-15-2025", "2025-05-15T12:00:00-0700", "Newer change"),
+            thread(site, "05-01-2025-update.1", "05-01-2025", "2025-05-01T12:00:00-0700", "Older change")]
+    site.pages["/forums/changelog.10/"] = INDEX.format(threads="\n".join(rows))
+    newer = site.pages.pop("/threads/05-15-2025-update.2/")
+    monkeypatch.setattr(fetcher, "_fetcher", Fetcher(workers=2, per_second=0, retries=0, mode="live"))
+
+    # the older thread is in, and reported so the caller re-exports the site despite the failure
+    assert check_for_patch(site.url("/forums/changelog.10/"), force=True) == 1
+    site.pages["/threads/05-15-2025-update.2/"] = newer
+    assert check_for_patch(site.url("/forums/changelog.10/"), force=True) == 1
+    titles = [row[0] for row in database.execute("SELECT title FROM patches ORDER BY id")]
+    assert titles == ["05-01-2025 Update", "05-15-2025 Update"]
@@ -0,0 +1,23 @@
+import pytest
+
+from newfiltering import extract_values
+
+
+@pytest.mark.parametrize("line, expected", [
+    ("Abrams: Siphon Life cooldown reduced from 45s to 35s", ("cooldown", 45.0, 35.0, "s", -22.22)),
+    ("Cooldown reduced from 30 to 25", ("cooldown", 30.0, 25.0, None, -16.67)),
+    ("Spirit Damage increased from 10% to 12%", ("damage", 10.0, 12.0, "%", 20.0)),
+    ("Fire rate increased from 20/25/30% to 25/30/35%", ("fire rate", 20.0, 25.0, "%", 25.0)),
+    ("Bullet damage reduced by 15%", ("damage", None, None, "%", -15.0)),
+    ("Ammo increases by 10%", ("ammo", None, None, "%", 10.0)),
+    # negative old values: the delta is relative to the old magnitude
+    ("Bullet resist from -20% to -30%", ("resist", -20.0, -30.0, "%", -50.0)),
+    # a unit on one side only, or two different ones, has no meaningful delta
+    ("Now deals from 10% Max HP to 300 HP", ("other", 10.0, 300.0, "%", None)),
+    ("Changed from +100 damage to -30s Cooldown", ("other", 100.0, -30.0, "s", None)),
+    ("Cooldown reduced from 30s to 25", ("cooldown", 30.0, 25.0, "s", None)),
+    ("Range changed from 10m to 500ms", ("range", 10.0, 500.0, "ms", None)),
+    ("Duration increased by 2s", (None, None, None, None, None)),
+])
+def test_extract_values(line, expected):
+    assert extract_values(line) == expected
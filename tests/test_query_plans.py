@@ -0,0 +1,10 @@
+from migrations import check_query_plans
+
+
+def test_hot_queries_are_index_backed(database):
+    assert check_query_plans() == []
+
+
+def test_missing_index_is_reported(database):
+    database.execute("DROP INDEX idx_patches_link")
+    assert [name for name, _ in check_query_plans()] == ["known links"]
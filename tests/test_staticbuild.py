@@ -0,0 +1,42 @@
+import os
+import time
+
+import staticbuild
+
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def test_replaced_hashes_stay_servable(tmp_path, monkeypatch):
+    static, dist = str(tmp_path / "static"), str(tmp_path / "static" / "dist")
+    css = os.path.join(static, "css", "style.css")
+    names = []
+    for colour in ("red", "green", "blue"):
+        write(css, f"body {{ color: {colour}; }}")
+        names.append(staticbuild.build(static, dist)["css/style.css"])
+    # two changes later the first stylesheet is still there for pages rendered before them
+    assert all(os.path.exists(os.path.join(dist, name)) for name in names)
+
+    later = time.time() + staticbuild.RETAIN + 1
+    monkeypatch.setattr(staticbuild.time, "time", lambda: later)
+    staticbuild.build(static, dist)
+    assert [os.path.exists(os.path.join(dist, name)) for name in names] == [False, False, True]
+
+
+def test_unchanged_build_keeps_the_manifest(tmp_path, monkeypatch):
+    static, dist = str(tmp_path / "static"), str(tmp_path / "static" / "dist")
+    monkeypatch.setattr(staticbuild, "MANIFEST", os.path.join(dist, "manifest.json"))
+    write(os.path.join(static, "css", "style.css"), "body { color: red; }")
+    staticbuild.build(static, dist)
+    version, built = staticbuild.asset_version()
+
+    os.utime(staticbuild.MANIFEST, (built - 60, built - 60))
+    staticbuild.build(static, dist)
+    assert staticbuild.asset_version() == (version, built - 60)
+
+    write(os.path.join(static, "css", "style.css"), "body { color: blue; }")
+    staticbuild.build(static, dist)
+    assert staticbuild.asset_version()[0] != version
@@ -1,58 +1,119 @@
-import sqlite3
-import requests
-from bs4 import BeautifulSoup
-from patchscrapper import patch_content, insert_patch
+import hashlib
+import json
+import time
+from patchscrapper import thread_links, fetch_patches, insert_patches
+from db import get_connection, transaction
+from fetcher import get_fetcher
+from newfiltering import refresh_stale
 
+FORUMS = "https://forums.playdeadlock.com/forums/changelog.10/"
 
-def scrapper_updater(forums="https://forums.playdeadlock.com/forums/changelog.10/"):
-    response = requests.get(forums)
-    if response.status_code != 200:
-        print("[scrapper_updater] Failed to fetch the forum page.")
-        return None
-    else:
-        print(f"[scrapper_updater] {response.status_code=}")
-
-    soup = BeautifulSoup(response.text, 'html.parser')
-    threads = soup.find_all("div", class_="structItem--thread")
-    latest_thread = threads[1]
-    link_container = latest_thread.find("div", class_="structItem-title")
-    if link_container:
-        link_tag = link_container.find("a", href=True)
-        if link_tag:
-            print(f"[scrapper_updater] Found link: {link_tag['href']}")
-            return "https://forums.playdeadlock.com" + link_tag['href']
-
-    print("[scrapper_updater] Link tag not found!")
-    return None
-
-
-def is_patch_new(link):
-    conn = sqlite3.connect("patch.db")
-    c = conn.cursor()
-    c.execute("SELECT id FROM patches WHERE link = ?", (link,))
-    result = c.fetchone()
-    conn.close()
-    return result is None
-
-
-def check_for_patch():
-    link = scrapper_updater()
-    if not link:
-        print("[check_for_patch] scrapper_updater returned no link")
-        return False
-
-    if not is_patch_new(link):
-        print("[check_for_patch] Patch already exists in the database.")
-        return False
-
-    content, timestamp, title, date = patch_content(link)
-
-    if content and timestamp:
-        print("[check_for_patch] New Patch Found!")
-        print(content)
-        insert_patch(title, content, link, timestamp, date)
-        return True
+# seconds between polls: back to POLL_MIN after a new patch, stretched while the forum stays quiet,
+# doubled per consecutive error
+POLL_MIN = 180
+POLL_MAX = 30 * 60
+QUIET_FACTOR = 1.5
+ERROR_MAX = 60 * 60
+
+
+# poll state (validators, body hash, schedule) lives in the meta table next to the page cache generation
+def load_state(forums):
+    row = get_connection().execute("SELECT value FROM meta WHERE key = ?", (f"updater:{forums}",)).fetchone()
+    state = json.loads(row[0]) if row else {}
+    state.setdefault("interval", POLL_MIN)
+    state.setdefault("next_poll", 0)
+    state.setdefault("failures", 0)
+    return state
+
+
+def save_state(forums, state):
+    with transaction() as conn:
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (f"updater:{forums}", json.dumps(state)))
+
+
+def schedule(state, outcome):
+    if outcome == "new":
+        state["interval"], state["failures"] = POLL_MIN, 0
+    elif outcome == "error":
+        state["failures"] += 1
+        state["interval"] = min(POLL_MIN * 2 ** state["failures"], ERROR_MAX)
+    elif state["failures"]:
+        state["interval"], state["failures"] = POLL_MIN, 0
     else:
+        state["interval"] = min(state["interval"] * QUIET_FACTOR, POLL_MAX)
+    state["next_poll"] = time.time() + state["interval"]
+
+
+def fetch_index(forums, state):
+    # ("error" | "unchanged" | "changed", html); unchanged on a 304 or a byte-identical body
+    headers = {}
+    if state.get("etag"):
+        headers["If-None-Match"] = state["etag"]
+    if state.get("last_modified"):
+        headers["If-Modified-Since"] = state["last_modified"]
+
+    response = get_fetcher().get(forums, headers=headers)
+    if response is None or response.status_code not in (200, 304):
+        print("[fetch_index] Failed to fetch the forum page.")
+        return "error", None
+    print(f"[fetch_index] {response.status_code=}")
+
+    if response.status_code == 304:
+        return "unchanged", None
+
+    state["etag"] = response.headers.get("ETag")
+    state["last_modified"] = response.headers.get("Last-Modified")
+    digest = hashlib.sha1(response.content).hexdigest()
+    if digest == state.get("hash"):
+        return "unchanged", None
+    state["hash"] = digest
+    return "changed", response.text
+
+
+def ingest(forums, text):
+    # every thread newer than the last stored one, so a missed poll or a down day is caught up in one go
+    # -> (outcome for the schedule, patches inserted); a partial failure still inserts the oldest threads
+    links = thread_links(forums, first_page=text, until_known=True)
+    if not links:
+        print("[check_for_patch] No new patches.")
+        return "unchanged", 0
+
+    print(f"[check_for_patch] {len(links)} new threads found")
+    patches_data = fetch_patches(links)
+    inserted = 0
+    if patches_data:
+        print(f"[check_for_patch] New Patch Found! {', '.join(title for title, *_ in patches_data)}")
+        inserted = insert_patches(list(reversed(patches_data)))
+
+    if len(patches_data) < len(links):
         print("[check_for_patch] Failed to extract patch content or timestamp.")
-        return False
+        return "error", inserted
+    return "new", inserted
+
+
+def check_for_patch(forums=FORUMS, force=False):
+    # called every minute by the scheduler, does nothing until the adaptive next_poll is due.
+    # -> number of patches inserted, also when some threads failed and the poll backs off
+    state = load_state(forums)
+    if not force and time.time() < state["next_poll"]:
+        return 0
+
+    # recategorize anything the current rules / lexicon would change before looking for new patches
+    refresh_stale()
+
+    inserted = 0
+    outcome, text = fetch_index(forums, state)
+    if outcome == "changed":
+        outcome, inserted = ingest(forums, text)
+        if outcome == "error":
+            # fetch and parse again next time instead of trusting the stored validators / hash,
+            # unfetched threads are still unseen while the index itself stays the same
+            for key in ("etag", "last_modified", "hash"):
+                state.pop(key, None)
+    elif outcome == "unchanged":
+        print("[check_for_patch] Forum index unchanged.")
 
+    schedule(state, outcome)
+    save_state(forums, state)
+    print(f"[check_for_patch] next poll in {state['interval']:.0f}s")
+    return inserted